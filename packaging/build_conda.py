@@ -3,6 +3,8 @@
 # This source code is licensed under the BSD license found in the
 # LICENSE file in the root directory of this source tree.
 import argparse
+import concurrent.futures
+import functools
 import os
 import shutil
 import subprocess
@@ -14,6 +16,13 @@ THIS_PATH = Path(__file__).resolve()
 SOURCE_ROOT_DIR = THIS_PATH.parents[1]
 
 
+@functools.lru_cache(maxsize=1)
+def _git_tag() -> str:
+    return subprocess.check_output(
+        ["git", "rev-parse", "--short", "HEAD"], text=True
+    ).strip()
+
+
 @dataclass
 class Build:
     """
@@ -26,6 +35,7 @@ class Build:
         conda_dirty: see intermediate files after build
         build_inside_tree: output in build/ not ../build
         is_release: whether this is an official versioned release
+        croot: conda build root, when not building inside the tree
     """
 
     python_version: str
@@ -38,6 +48,7 @@ class Build:
     conda_debug: bool = False
     conda_dirty: bool = False
     build_inside_tree: bool = False
+    croot: str = "../build"
 
     def _set_env_for_build(self) -> None:
         """
@@ -47,10 +58,8 @@ class Build:
         assert (
             "BUILD_VERSION" in os.environ
         ), "BUILD_VERSION must be set as env variable"
-        tag = subprocess.check_output(
-            ["git", "rev-parse", "--short", "HEAD"], text=True
-        ).strip()
-        os.environ["GIT_TAG"] = tag
+        if "GIT_TAG" not in os.environ:
+            os.environ["GIT_TAG"] = _git_tag()
         os.environ["PYTORCH_VERSION"] = self.pytorch_version
         os.environ["CU_VERSION"] = self.cuda_version
         os.environ["SOURCE_ROOT_DIR"] = str(SOURCE_ROOT_DIR)
@@ -95,7 +104,7 @@ class Build:
         if self.conda_dirty:
             args += ["--dirty"]
         if not self.build_inside_tree:
-            args += ["--croot", "../build"]
+            args += ["--croot", self.croot]
         return args + ["packaging/xformers"]
 
     def do_build(self) -> None:
@@ -114,7 +123,7 @@ class Build:
         assert not self.build_inside_tree
         artifacts = Path("packages")
         artifacts.mkdir(exist_ok=True)
-        for filename in Path("../build/linux-64").resolve().glob("*.tar.bz2"):
+        for filename in (Path(self.croot) / "linux-64").resolve().glob("*.tar.bz2"):
             print("moving", filename, "to", artifacts)
             shutil.move(filename, artifacts)
         if store_pytorch_package:
@@ -123,10 +132,18 @@ class Build:
                 shutil.move(filename, artifacts)
 
 
+def _do_build(pkg: Build) -> None:
+    pkg.do_build()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Build the conda package.")
     parser.add_argument(
-        "--python", metavar="3.X", required=True, help="python version e.g. 3.10"
+        "--python",
+        metavar="3.X",
+        required=True,
+        nargs="+",
+        help="python version e.g. 3.10. Several versions are built concurrently",
     )
     parser.add_argument(
         "--cuda-dep-runtime", metavar="1X.Y", required=True, help="eg '>=11.7,<11.9"
@@ -157,17 +174,37 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    pkg = Build(
-        pytorch_channel=args.pytorch_channel,
-        python_version=args.python,
-        pytorch_version=args.pytorch,
-        cuda_version=args.cuda,
-        build_inside_tree=args.build_inside_tree,
-        cuda_dep_runtime=args.cuda_dep_runtime,
-    )
-
-    pkg.do_build()
-    pkg.move_artifacts_to_store(store_pytorch_package=args.store_pytorch_package)
+    if len(args.python) > 1 and args.build_inside_tree:
+        parser.error("--build-inside-tree only supports a single --python version")
+
+    pkgs = [
+        Build(
+            pytorch_channel=args.pytorch_channel,
+            python_version=python,
+            pytorch_version=args.pytorch,
+            cuda_version=args.cuda,
+            build_inside_tree=args.build_inside_tree,
+            cuda_dep_runtime=args.cuda_dep_runtime,
+            # Concurrent builds can't share a build root
+            croot=f"../build/py{python}" if len(args.python) > 1 else "../build",
+        )
+        for python in args.python
+    ]
+
+    if len(pkgs) == 1:
+        pkgs[0].do_build()
+    else:
+        # Resolve the tag once, concurrent builds inherit it from the env
+        os.environ.setdefault("GIT_TAG", _git_tag())
+        # Each build runs in its own process, as `do_build` sets env variables
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(pkgs)) as pool:
+            for future in [pool.submit(_do_build, pkg) for pkg in pkgs]:
+                future.result()
+    for i, pkg in enumerate(pkgs):
+        # The PyTorch package is shared between builds: only move it once
+        pkg.move_artifacts_to_store(
+            store_pytorch_package=args.store_pytorch_package and i == len(pkgs) - 1
+        )
 
 
 # python packaging/conda/build_conda.py  --cuda 11.6 --python 3.10 --pytorch 1.12.1
@@ -0,0 +1,24 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--slow-ref",
+        action="store_true",
+        help="compute reference attention without tiling over the keys",
+    )
+
+
+def pytest_configure(config):
+    # Registered by pytest-xdist when installed - declare it otherwise so
+    # that tests can use it without triggering unknown marker warnings
+    config.addinivalue_line(
+        "markers", "xdist_group(name): run tests of the same group on one worker"
+    )
+    if config.getoption("--slow-ref"):
+        from . import utils
+
+        utils.REF_KV_BLOCK_SIZE = None
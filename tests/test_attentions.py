@@ -3,12 +3,17 @@
 # This source code is licensed under the BSD license found in the
 # LICENSE file in the root directory of this source tree.
 
+import json
 import math
+import os
+import subprocess
+import sys
 from typing import Tuple
 
 import pytest
 import torch
 
+import xformers
 from xformers.components import (
     InputProjection,
     InputProjectionConfig,
@@ -509,4 +514,101 @@ def test_torch_script_ability(
     assert torch.allclose(res, res_traced)
 
 
+@pytest.mark.parametrize("device", DEVICES)
+def test_linformer_shorter_sequence(device: torch.device):
+    # Shorter sequences should behave as if they were zero padded to seq_len
+    attention = build_attention(
+        {"name": "linformer", "dropout": 0.0, "seq_len": SEQ, "k": SEQ // 4}
+    ).to(device)
+
+    q, k, v = [torch.rand((BATCH, SEQ // 2, MODEL), device=device) for _ in range(3)]
+    res = attention(q, k, v)
+
+    pad_dims = (0, 0, 0, SEQ - SEQ // 2)
+    q_pad, k_pad, v_pad = [torch.nn.functional.pad(x, pad_dims) for x in (q, k, v)]
+    res_pad = attention(q_pad, k_pad, v_pad)
+
+    assert res.shape == q.shape
+    assert torch.allclose(res, res_pad[:, : SEQ // 2], atol=1e-6)
+
+
+@pytest.mark.parametrize("bias", [False, True])
+def test_inproj_packed_self_attention(bias: bool):
+    in_proj = InputProjection(
+        query_proj_params=InputProjectionConfig(MODEL, MODEL, bias=bias),
+        key_proj_params=InputProjectionConfig(MODEL, MODEL, bias=bias),
+        value_proj_params=InputProjectionConfig(MODEL, MODEL // 2, bias=bias),
+    )
+    x = torch.rand((BATCH, SEQ, MODEL))
+    ref = [proj(x) for proj in (in_proj.q_proj, in_proj.k_proj, in_proj.v_proj)]
+
+    # Self attention at inference goes through a single packed projection
+    with torch.no_grad():
+        res = in_proj(query=x, key=x, value=x)
+        for r, r_ref in zip(res, ref):
+            assert torch.allclose(r, r_ref, atol=1e-6)
+
+        # In-place updates of the weights are picked up
+        in_proj.k_proj.weight.mul_(2.0)
+        _, k, _ = in_proj(query=x, key=x, value=x)
+        assert not torch.allclose(k, res[1], atol=1e-3)
+        assert torch.allclose(k, in_proj.k_proj(x), atol=1e-6)
+
+        # So are conversions of the module
+        in_proj.double()
+        q, _, _ = in_proj(query=x.double(), key=x.double(), value=x.double())
+        assert q.dtype == torch.float64
+        assert torch.allclose(q, in_proj.q_proj(x.double()), atol=1e-6)
+
+
+_REGISTRY_PROBE = """
+import json, sys
+from xformers.components import attention
+registered = sorted(attention.ATTENTION_REGISTRY)
+found = [n for n in json.loads(sys.argv[1]) if attention._lookup_attention(n)]
+print(json.dumps([registered, found]))
+"""
+
+
+@pytest.mark.parametrize("eager_import", ["1", "0"])
+def test_eager_import(eager_import: str):
+    # XFORMERS_EAGER_IMPORT only changes when the attentions get registered
+    env = dict(os.environ, XFORMERS_EAGER_IMPORT=eager_import)
+    # Same xformers as this process
+    root = os.path.dirname(os.path.dirname(xformers.__file__))
+    env["PYTHONPATH"] = os.pathsep.join([root, env.get("PYTHONPATH", "")])
+    names = sorted(ATTENTION_REGISTRY)
+    out = subprocess.run(
+        [sys.executable, "-c", _REGISTRY_PROBE, json.dumps(names)],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    registered, found = json.loads(out.splitlines()[-1])
+
+    assert found == names
+    if eager_import == "1":
+        assert registered == names
+    else:
+        assert "scaled_dot_product" in registered
+        assert "pooling" not in registered
+
+
+@pytest.mark.parametrize("heads", [1, 4])
+@pytest.mark.parametrize("device", DEVICES)
+def test_precomputed_kv(heads: int, device: torch.device):
+    multi_head = _get_multihead("scaled_dot_product", 0.0, 0.0, False, heads, device)
+
+    query = torch.rand((BATCH, SEQ // 2, MODEL), device=device)
+    memory = torch.rand((BATCH, SEQ, MODEL), device=device)
+    res = multi_head(query=query, key=memory, value=memory)
+
+    # The projected keys and values can be reused across calls
+    kv = multi_head.project_kv(memory, memory)
+    res_precomputed = multi_head(query=query, precomputed_kv=kv)
+
+    assert torch.allclose(res, res_precomputed, atol=1e-6)
+
+
 # TODO: way more unit tests..
@@ -0,0 +1,81 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+import torch
+
+from xformers.factory import (
+    xFormerDecoderBlock,
+    xFormerDecoderConfig,
+    xFormerEncoderBlock,
+    xFormerEncoderConfig,
+)
+
+BATCH = 2
+SEQ = 16
+MEMORY_SEQ = 24
+EMB = 32
+HEADS = 4
+
+
+def _attention_config(causal: bool):
+    return {
+        "num_heads": HEADS,
+        "residual_dropout": 0.0,
+        "attention": {"name": "scaled_dot_product", "dropout": 0.0, "causal": causal},
+    }
+
+
+def _feedforward_config():
+    return {
+        "name": "MLP",
+        "dropout": 0.0,
+        "activation": "relu",
+        "hidden_layer_multiplier": 2,
+    }
+
+
+@pytest.mark.parametrize("residual_norm_style", ["pre", "post", "deepnorm"])
+def test_decoder_precomputed_cross_kv(residual_norm_style: str):
+    config = xFormerDecoderConfig(
+        dim_model=EMB,
+        feedforward_config=_feedforward_config(),
+        multi_head_config_masked=_attention_config(causal=True),
+        multi_head_config_cross=_attention_config(causal=False),
+        residual_norm_style=residual_norm_style,
+        use_triton=False,
+    )
+    torch.manual_seed(0)
+    block = xFormerDecoderBlock(config).eval()
+
+    x = torch.randn(BATCH, SEQ, EMB)
+    memory = torch.randn(BATCH, MEMORY_SEQ, EMB)
+
+    # Goes through the normalization and residual wrappers down to the cross attention
+    ref = block(x, memory)
+    out = block(x, memory, cross_kv=block.precompute_cross_kv(memory))
+    assert torch.allclose(out, ref, atol=1e-6, rtol=1e-5)
+
+
+def test_encoder_torch_compile():
+    def build(torch_compile: bool) -> xFormerEncoderBlock:
+        config = xFormerEncoderConfig(
+            dim_model=EMB,
+            feedforward_config=_feedforward_config(),
+            multi_head_config=_attention_config(causal=False),
+            use_triton=False,
+            torch_compile=torch_compile,
+        )
+        torch.manual_seed(0)
+        return xFormerEncoderBlock(config).eval()
+
+    block = build(torch_compile=False)
+    block_compiled = build(torch_compile=True)
+
+    # Compiled in place, the parameters are the same
+    assert block.state_dict().keys() == block_compiled.state_dict().keys()
+
+    x = torch.randn(BATCH, SEQ, EMB)
+    assert torch.allclose(block_compiled(x), block(x), atol=1e-5, rtol=1e-5)
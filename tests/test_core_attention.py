@@ -12,7 +12,11 @@ from torch import nn
 from xformers import _is_triton_available
 from xformers.components.attention._sputnik_sparse import SparseCS
 from xformers.components.attention.attention_mask import AttentionMask
-from xformers.components.attention.core import scaled_dot_product_attention
+from xformers.components.attention.core import (
+    bmm,
+    scaled_dot_product_attention,
+    scaled_query_key_softmax,
+)
 
 _is_blocksparse_available = _is_triton_available()
 
@@ -83,6 +87,52 @@ def test_core_attention_mask_types():
     r_dense_add = scaled_dot_product_attention(a, a, a, float_mask_add)
 
 
+@pytest.mark.parametrize("device", _devices)
+@pytest.mark.parametrize(
+    "mask_type",
+    ["none", "bool_2d", "bool_3d", "additive_3d", "additive_3d_b1", "attention_mask"],
+)
+@pytest.mark.parametrize("fully_masked_row", [False, True])
+def test_fused_dense_attention_matches_legacy(device, mask_type, fully_masked_row):
+    # Dense attention goes through PyTorch's fused SDPA,
+    # check it against the unfused matmul / softmax / matmul path
+    if mask_type == "none" and fully_masked_row:
+        pytest.skip("Nothing to mask")
+
+    torch.manual_seed(0)
+    b, s, d = 4, 64, 16
+    q, k, v = [torch.randn(b, s, d, device=device) for _ in range(3)]
+
+    keep = torch.rand(b, s, s, device=device) > 0.3
+    keep[:, :, 0] = True
+    if fully_masked_row:
+        keep[:, 5] = False
+
+    mask = None
+    if mask_type == "bool_2d":
+        mask = keep[0]
+    elif mask_type == "bool_3d":
+        mask = keep
+    elif mask_type.startswith("additive_3d"):
+        mask = torch.zeros_like(keep, dtype=q.dtype).masked_fill(~keep, float("-inf"))
+        mask += torch.randn_like(mask)
+        if mask_type == "additive_3d_b1":
+            mask = mask[:1]
+    elif mask_type == "attention_mask":
+        mask = AttentionMask.from_bool(keep[0])
+
+    r_fused = scaled_dot_product_attention(q, k, v, mask)
+    r_legacy = bmm(scaled_query_key_softmax(q, k, mask), v)
+
+    if fully_masked_row:
+        # NaN in the legacy path. Depending on the SDPA backend, NaN or zeros
+        assert r_legacy[:, 5].isnan().all()
+        assert r_fused[:, 5].isnan().all() or (r_fused[:, 5] == 0).all()
+        r_fused[:, 5] = r_legacy[:, 5] = 0.0
+
+    assert torch.allclose(r_fused, r_legacy, atol=1e-5)
+
+
 @pytest.mark.parametrize("device", _devices)
 def test_amp_attention_dense_no_mask(device):
     b, s, d = 8, 64, 32
@@ -0,0 +1,51 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+import pytest
+import torch
+
+from xformers import _is_triton_available
+from xformers.ops.layernorm import layer_norm_add
+
+from .utils import assert_allclose, cuda_only
+
+DTYPES = {"f16": torch.float16, "bf16": torch.bfloat16, "f32": torch.float32}
+
+
+@cuda_only
+@pytest.mark.skipif(not _is_triton_available(), reason="requires triton")
+# 273 and 9000 are not multiples of the block size, 9000 spans two blocks
+@pytest.mark.parametrize("K", [273, 4096, 9000])
+# Large means are where a single-pass variance can lose precision
+@pytest.mark.parametrize("mean", [0.0, 1000.0])
+@pytest.mark.parametrize("include_affine", [True, False])
+@pytest.mark.parametrize("dtype", ["f16", "bf16", "f32"])
+def test_layer_norm_add(K: int, mean: float, include_affine: bool, dtype: str):
+    atol = 5e-4 if dtype == "f32" else 1e-2
+    rtol = 1e-5 if dtype == "f32" else 0.01
+    torch.manual_seed(1)
+    B, M = 7, 13
+    device = torch.device("cuda")
+    dtype_ = DTYPES[dtype]
+
+    x = (torch.randn(B, M, K, device=device) + mean).to(dtype_)
+    y = torch.randn(B, M, K, device=device, dtype=dtype_)
+    weight, bias = None, None
+    if include_affine:
+        weight = torch.randn(K, device=device, dtype=dtype_)
+        bias = torch.randn(K, device=device, dtype=dtype_)
+    x_orig = x.clone()
+
+    out = layer_norm_add(x, y, weight, bias)
+    baseline = torch.nn.functional.layer_norm(
+        x.double() + y.double(),
+        (K,),
+        None if weight is None else weight.double(),
+        None if bias is None else bias.double(),
+    )
+    assert out.shape == x.shape
+    assert out.dtype == dtype_
+    assert_allclose(out.double(), baseline, atol=atol, rtol=rtol)
+    # The sum is never written back
+    assert torch.equal(x, x_orig)
@@ -0,0 +1,99 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+import torch
+
+from xformers.components.attention import LocalAttention
+from xformers.components.attention._sputnik_sparse import SparseCS
+from xformers.components.attention.attention_patterns import local_1d_pattern
+from xformers.components.attention.local import (
+    _band_density,
+    _build_local_mask,
+    _is_flex_available,
+    clear_local_mask_cache,
+)
+
+
+@pytest.mark.skipif(
+    not (_is_flex_available and torch.cuda.is_available()),
+    reason="FlexAttention on CUDA is required",
+)
+@pytest.mark.parametrize("causal", [True, False])
+@pytest.mark.parametrize("window_size", [1, 33])
+def test_local_attention_flex(causal: bool, window_size: int):
+    b, s, d = 4, 256, 64
+    device = torch.device("cuda")
+
+    torch.manual_seed(42)
+    q, k, v = [torch.rand(b, s, d, device=device) for _ in range(3)]
+
+    attention = LocalAttention(causal=causal, window_size=window_size)
+    attention_flex = LocalAttention(
+        causal=causal, window_size=window_size, use_flex=True
+    )
+
+    r_mask = attention(q, k, v)
+    r_flex = attention_flex(q, k, v)
+
+    assert torch.allclose(r_mask, r_flex, atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize("causal", [True, False])
+def test_local_attention_full_window(causal: bool):
+    b, s, d = 4, 32, 16
+
+    torch.manual_seed(42)
+    q, k, v = [torch.rand(b, s, d) for _ in range(3)]
+
+    # The window covers the whole sequence, the mask is not materialized
+    attention = LocalAttention(causal=causal, window_size=2 * s + 1)
+    r_local = attention(q, k, v)
+
+    att = (q @ k.transpose(-2, -1)) / d**0.5
+    if causal:
+        att = att.masked_fill(~torch.ones(s, s, dtype=torch.bool).tril(), float("-inf"))
+    r_ref = torch.softmax(att, dim=-1) @ v
+
+    assert attention.attention_mask is None
+    assert torch.allclose(r_local, r_ref, atol=1e-5, rtol=1e-5)
+
+    # Unless sparsity is forced, in which case the sparse mask is still used
+    attention_sparse = LocalAttention(
+        causal=causal, window_size=2 * s + 1, force_sparsity=True
+    )
+    r_sparse = attention_sparse(q, k, v)
+
+    mask = attention_sparse.attention_mask
+    assert mask is not None
+    assert isinstance(mask, SparseCS) or mask.is_sparse
+    assert torch.allclose(r_sparse, r_ref, atol=1e-5, rtol=1e-5)
+
+
+def test_local_attention_mask_cache():
+    shape, device = torch.Size([4, 32, 16]), torch.device("cpu")
+    clear_local_mask_cache()
+
+    # Layers with the same settings share their mask, until the cache is cleared
+    mask = LocalAttention(window_size=5)._get_local_mask(shape, device)
+    sibling = LocalAttention(window_size=5)
+    assert sibling._get_local_mask(shape, device) is mask
+    assert _build_local_mask.cache_info().currsize == 1
+
+    clear_local_mask_cache()
+    assert _build_local_mask.cache_info().currsize == 0
+    assert sibling._get_local_mask(shape, device) is not mask
+
+
+@pytest.mark.parametrize("causal", [True, False])
+@pytest.mark.parametrize("seq_len", [1, 16, 37])
+@pytest.mark.parametrize("window_size", [1, 5, 33, 129])
+def test_band_density(causal: bool, seq_len: int, window_size: int):
+    mask = local_1d_pattern(seq_len, window_size)
+    if causal:
+        mask.tril_()
+
+    density = torch.count_nonzero(mask).item() / mask.numel()
+    assert _band_density(seq_len, window_size // 2, causal) == pytest.approx(density)
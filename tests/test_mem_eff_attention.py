@@ -6,17 +6,21 @@
 import logging
 import math
 import random
-from functools import partial
+from collections import OrderedDict
+from functools import lru_cache, partial
 from typing import Any, List, Optional, Sequence, Tuple, Type, TypeVar, Union
 
+import numpy as np
 import pytest
 import torch
 import torch.nn.functional as F
+from scipy.special import gammaln
 from scipy.stats import binomtest
 from torch.utils.checkpoint import checkpoint
 
 import xformers.ops
-from xformers.attn_bias_utils import create_attn_bias
+from xformers import attn_bias_utils
+from xformers.attn_bias_utils import create_attn_bias, ref_attention
 from xformers.ops import fmha
 from xformers.ops.fmha import ALL_BW_OPS, ALL_FW_OPS
 from xformers.ops.fmha.common import AttentionFwOpBase, AttentionOpBase
@@ -27,6 +31,7 @@ from .utils import (
     cuda_only,
     disable_on_rocm,
     disable_tf32,
+    no_tf32,
     pack_kv_cache,
     ref_attention_bmhk_for_test,
     ref_attention_for_test,
@@ -60,6 +65,87 @@ T = TypeVar(
 logger = logging.getLogger("xformers")
 
 
+_REF_CACHE_MAX_ENTRIES = 4
+_TENSOR_BIAS_CACHE_MAX_ENTRIES = 16
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _ref_attention_cache():
+    # Reuse the fp32 reference inputs and scores across calls on the same q/k/v,
+    # as well as the dense biases, and drop them once this module is done
+    cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def cached(tag, fn):
+        def wrapper(q, k, v, scale):
+            inputs = (q, k, v)
+            if torch.is_grad_enabled() and any(x.requires_grad for x in inputs):
+                return fn(q, k, v, scale)
+            # The entry keeps the inputs alive, so their storage can't be reused
+            # by another tensor while it exists. `_version` catches in-place updates
+            key = (tag, scale) + tuple(
+                (x.data_ptr(), x.shape, x.stride(), x.dtype, x.device, x._version)
+                for x in inputs
+            )
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key][1]
+            out = fn(q, k, v, scale)
+            cache[key] = (inputs, out)
+            while len(cache) > _REF_CACHE_MAX_ENTRIES:
+                cache.popitem(last=False)
+            return out
+
+        return wrapper
+
+    scores = cached("scores", attn_bias_utils._ref_attention_scores)
+
+    def _ref_attention_scores(q, k, v, scale, attn_bias=None):
+        # The cached scores are shared by all biases, which are added after
+        attn, v = scores(q, k, v, scale)
+        if attn_bias is not None:
+            attn = attn + attn_bias.float()
+        return attn, v
+
+    # Dense biases are drawn from a generator seeded by their arguments, so the
+    # same ones can be handed out again. They must not be modified in-place
+    bias_cache: "OrderedDict[tuple, torch.Tensor]" = OrderedDict()
+    create_tensor_bias = attn_bias_utils._create_tensor_bias
+
+    def _create_tensor_bias(*args, requires_grad):
+        # The gradient would leak into other users of a shared bias
+        if requires_grad:
+            return create_tensor_bias(*args, requires_grad=True)
+        if args in bias_cache:
+            bias_cache.move_to_end(args)
+            return bias_cache[args]
+        bias = create_tensor_bias(*args, requires_grad=False)
+        bias_cache[args] = bias
+        while len(bias_cache) > _TENSOR_BIAS_CACHE_MAX_ENTRIES:
+            bias_cache.popitem(last=False)
+        return bias
+
+    inputs = cached("inputs", attn_bias_utils._ref_attention_inputs)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(attn_bias_utils, "_ref_attention_scores", _ref_attention_scores)
+        mp.setattr(attn_bias_utils, "_ref_attention_inputs", inputs)
+        mp.setattr(attn_bias_utils, "_create_tensor_bias", _create_tensor_bias)
+        yield
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _cuda_stream():
+    # Queue the whole module on a single dedicated stream, rather than
+    # the legacy default stream which synchronizes with every other stream
+    if not torch.cuda.is_available():
+        yield
+        return
+    stream = torch.cuda.Stream()
+    stream.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(stream):
+        yield
+    torch.cuda.current_stream().wait_stream(stream)
+
+
 def _filter_unsupported_ops(ops: Sequence[T]) -> List[T]:
     return [
         op
@@ -96,7 +182,10 @@ def sample_random_supported_fw(
     raise NotImplementedError(f"Could not find a FW operator for: {inp}")
 
 
-def generate_test_shapes_B_Mq_Mkv_H_K_Kv(op):
+# Shapes only depend on the operator, but they are enumerated once for every
+# parametrization below (FW, FW without unpadded LSE, BW, and the `__xs` variants)
+@lru_cache(maxsize=None)
+def generate_test_shapes_B_Mq_Mkv_H_K_Kv(op) -> Tuple[Tuple[int, ...], ...]:
     shapes = []
     for B in op._TEST_BATCH_SIZES:
         for Mq in [32, 256]:
@@ -161,7 +250,7 @@ def generate_test_shapes_B_Mq_Mkv_H_K_Kv(op):
                 continue
             found_count += 1
             shapes.append((B, Mq, Mkv, H, K, Kv))
-    return shapes
+    return tuple(shapes)
 
 
 def make_id(op, device, dtype, bias_type, *shape):
@@ -237,9 +326,17 @@ def _generate_op_device_dtype_biasT_B_Mq_Mkv_H_K_Kv(
                     continue
                 for dtype in op.SUPPORTED_DTYPES:
                     combination.append((op, device, dtype, bias_type, *shape))
+    # With `pytest -n auto --dist loadgroup`, all the cases of a given
+    # op/device/dtype run on the same worker and share its kernel caches
     return {
-        "argvalues": combination,
-        "ids": [make_id(*c) for c in combination],
+        "argvalues": [
+            pytest.param(
+                c,
+                id=make_id(*c),
+                marks=pytest.mark.xdist_group(name=f"{c[0].NAME}-{c[1]}-{c[2]}"),
+            )
+            for c in combination
+        ],
     }
 
 
@@ -521,6 +618,38 @@ def test_forward(opFW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv, packed, fmt, **kwargs)
     )
 
 
+@pytest.mark.parametrize("kv_block_size", [1, 7, 64])
+@pytest.mark.parametrize("with_dropout", [False, True])
+def test_ref_attention_tiled(kv_block_size: int, with_dropout: bool) -> None:
+    torch.manual_seed(0)
+    B, Mq, Mkv, K = 3, 17, 100, 16
+    q, k, v = [torch.randn([B, M, K]) * 3 for M in [Mq, Mkv, Mkv]]
+    attn_bias = torch.randn([B, Mq, Mkv])
+    # Some rows only have keys in the last block
+    attn_bias[0, :4, :-1] = -math.inf
+    p, drop_mask = 0.0, None
+    if with_dropout:
+        p = 0.3
+        drop_mask = (torch.rand([B, Mq, Mkv]) > p).float()
+    ref = ref_attention(q, k, v, attn_bias, drop_mask, p)
+    out = ref_attention(q, k, v, attn_bias, drop_mask, p, kv_block_size=kv_block_size)
+    assert_allclose(out, ref, atol=1e-5, rtol=1e-5)
+
+
+def test_ref_attention_tiled_masked_first_block() -> None:
+    torch.manual_seed(0)
+    B, Mq, Mkv, K = 2, 8, 20, 16
+    q, k, v = [torch.randn([B, M, K]) for M in [Mq, Mkv, Mkv]]
+    # The first block is fully masked, and the next ones would underflow
+    # if the running max was reset to 0
+    attn_bias = torch.full([B, Mq, Mkv], -200.0)
+    attn_bias[..., :5] = -math.inf
+    ref = ref_attention(q, k, v, attn_bias)
+    out = ref_attention(q, k, v, attn_bias, kv_block_size=5)
+    assert ref.isfinite().all()
+    assert_allclose(out, ref, atol=1e-5, rtol=1e-5)
+
+
 @cuda_only
 @pytest.mark.parametrize("k_len", [5, 6, 32])
 @pytest.mark.parametrize("batch_size", [1, 4])
@@ -533,7 +662,9 @@ def test_key_query_all_ones(q_len, kv_len, batch_size, k_len):
     dtype = torch.float16 if torch.version.hip else torch.float32
     query = torch.ones((batch_size, q_len, k_len), device=device, dtype=dtype)
     key = torch.ones((batch_size, kv_len, k_len), device=device, dtype=dtype)
-    value = torch.randn((batch_size, kv_len, k_len), device=device, dtype=dtype) * scale
+    value = torch.normal(
+        0.0, scale, (batch_size, kv_len, k_len), device=device, dtype=dtype
+    )
 
     out = xformers.ops.memory_efficient_attention(query, key, value)
     # this should be equivalent to the average over value
@@ -552,7 +683,6 @@ def _block_diag_reshape_lse(
     return torch.cat(parts, dim=1).unsqueeze(0)
 
 
-@disable_tf32
 @parametrize_opFW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv
 def test_logsumexp(opFW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv):
     (
@@ -584,7 +714,10 @@ def test_logsumexp(opFW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv):
     )
     query = query.transpose(1, 2)
     key = key.transpose(1, 2)
-    attn = (query.float() / k**0.5) @ key.float().transpose(-2, -1)
+    with no_tf32():
+        # Scale the scores in-place rather than materializing a scaled query
+        attn = torch.einsum("bhqk,bhmk->bhqm", query.float(), key.float())
+        attn.mul_(1 / k**0.5)
     if attn_bias is not None:
         if isinstance(
             attn_bias,
@@ -659,11 +792,25 @@ def test_logsumexp_mqa(op):
     assert_allclose(lse[0, :, 0], ref_lse[:, 0], atol=2e-4)
 
 
-@disable_tf32
 @pytest.mark.parametrize("fmt", ["BMK", "BMHK"])
-@pytest.mark.parametrize("grad_out_contiguous", [False, True])
 @parametrize_opBW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv
-def test_backward(
+def test_backward(opBW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv, fmt):
+    _test_backward(
+        opBW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv, grad_out_contiguous=True, fmt=fmt
+    )
+
+
+# A non-contiguous grad_out only changes how it is read by the kernels, and does
+# not interact with the shapes: a single shape per op is enough
+@pytest.mark.parametrize("fmt", ["BMK", "BMHK"])
+@parametrize_opBW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv__xs
+def test_backward_noncontiguous_grad_out(opBW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv, fmt):
+    _test_backward(
+        opBW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv, grad_out_contiguous=False, fmt=fmt
+    )
+
+
+def _test_backward(
     opBW_device_dtype_biasT_B_Mq_Mkv_H_K_Kv,
     grad_out_contiguous,
     fmt,
@@ -742,9 +889,7 @@ def test_backward(
 
     grad_out = torch.randn_like(out)
     if grad_out_contiguous is False:
-        grad_out = torch.tensor([1.0], dtype=query.dtype, device=device)[
-            None, None, :
-        ].expand_as(out)
+        grad_out = torch.ones((), dtype=query.dtype, device=device).expand_as(out)
 
     out.backward(grad_out)
 
@@ -765,8 +910,10 @@ def test_backward(
         if attn_bias_grad is not None:
             grads.append(attn_bias_grad)
 
-    ref = ref_attention_for_test(query, key, value, attn_bias, scale=scale)
-    ref.backward(grad_out)
+    # Only the reference needs exact fp32 matmuls, in both passes
+    with no_tf32():
+        ref = ref_attention_for_test(query, key, value, attn_bias, scale=scale)
+        ref.backward(grad_out)
 
     assert_allclose(
         out.float(),
@@ -826,21 +973,30 @@ def _vec_binom_test(x, n, p):
     this makes our tests much faster
     reference: https://github.com/scipy/scipy/blob/v1.8.0/scipy/stats/_morestats.py#L2609-L2702
     """
-    import numpy as np
-    from scipy.stats import distributions
-
-    x = np.atleast_1d(x)
-    d = distributions.binom.pmf(x, n, p)[:, None]
-    rerr = 1 + 1e-7
+    x = np.atleast_1d(np.asarray(x)).astype(np.int64)
+    # Binomial PMF over its whole support, computed once in log-space
+    i = np.arange(n + 1)
+    pmf = np.exp(
+        gammaln(n + 1)
+        - gammaln(i + 1)
+        - gammaln(n - i + 1)
+        + i * np.log(p)
+        + (n - i) * np.log1p(-p)
+    )
+    # cdf[m + 1] = P(X <= m) and sf[m + 1] = P(X > m), for m in [-1, n]
+    cdf = np.concatenate([[0.0], np.cumsum(pmf)])
+    sf = np.concatenate([np.cumsum(pmf[::-1])[::-1], [0.0]])
+
+    # Counting how many `pmf[i] <= d` doesn't depend on the order of `i`, so
+    # sort once and binary-search instead of comparing against every `i`
+    d = pmf[x] * (1 + 1e-7)
     # x < p * n case
-    i = np.arange(np.ceil(p * n), n + 1)
-    y = np.sum(distributions.binom.pmf(i, n, p) <= d * rerr, axis=1)
-    pval1 = distributions.binom.cdf(x, n, p) + distributions.binom.sf(n - y, n, p)
+    y = np.searchsorted(np.sort(pmf[int(np.ceil(p * n)) :]), d, side="right")
+    pval1 = cdf[x + 1] + sf[n - y + 1]
 
     # other case
-    i = np.arange(np.floor(p * n) + 1)
-    y = np.sum(distributions.binom.pmf(i, n, p) <= d * rerr, axis=1)
-    pval2 = distributions.binom.cdf(y - 1, n, p) + distributions.binom.sf(x - 1, n, p)
+    y = np.searchsorted(np.sort(pmf[: int(np.floor(p * n)) + 1]), d, side="right")
+    pval2 = cdf[y] + sf[x]
 
     pval = np.where(x < p * n, pval1, pval2)
     pval = np.minimum(1.0, pval)
@@ -887,9 +1043,15 @@ def test_dropout(op, q_len, kv_len, batch_size, k_len, p, seed, attn_bias):
     if torch.version.hip and op == fmha.ck.FwOp:
         dtype = torch.float16
 
-    query = torch.randn((batch_size, q_len, k_len), device=device, dtype=dtype) * scale
-    key = torch.randn((batch_size, kv_len, k_len), device=device, dtype=dtype) * scale
-    value = torch.randn((batch_size, kv_len, k_len), device=device, dtype=dtype) * scale
+    query = torch.normal(
+        0.0, scale, (batch_size, q_len, k_len), device=device, dtype=dtype
+    )
+    key = torch.normal(
+        0.0, scale, (batch_size, kv_len, k_len), device=device, dtype=dtype
+    )
+    value = torch.normal(
+        0.0, scale, (batch_size, kv_len, k_len), device=device, dtype=dtype
+    )
 
     inputs_for_support_check = fmha.Inputs(query, key, value, attn_bias, p, None)
     if not op.supports(inputs_for_support_check):
@@ -920,15 +1082,19 @@ def test_dropout(op, q_len, kv_len, batch_size, k_len, p, seed, attn_bias):
     num_trials = 1000
     p_val_tol = 1e-6
     keep_prob = 1 - p
-    masks = []
-    for i in range(num_trials):
-        mask = _get_drop_mask(op, batch_size, q_len, kv_len, p, device)
-        masks.append(mask.clone().cpu())
-    masks = torch.stack(masks, dim=0)
-    p_value = binomtest(int(masks.sum()), masks.numel(), p=keep_prob).pvalue
+    # Sample all the trials at once, as extra batch elements, and only bring
+    # back the number of times each element was kept
+    masks_sum = (
+        _get_drop_mask(op, num_trials * batch_size, q_len, kv_len, p, device)
+        .reshape(num_trials, batch_size, q_len, kv_len)
+        .sum(0)
+    )
+    masks_sum = masks_sum.cpu().flatten()
+    p_value = binomtest(
+        int(masks_sum.sum()), num_trials * masks_sum.numel(), p=keep_prob
+    ).pvalue
     assert p_value > p_val_tol, p_value
-    masks = masks.sum(0).flatten()
-    p_values = _vec_binom_test(masks, num_trials, p=keep_prob)
+    p_values = _vec_binom_test(masks_sum, num_trials, p=keep_prob)
     assert all(p_values > p_val_tol)
 
 
@@ -940,9 +1106,11 @@ def _test_dropout_backward(q_len, kv_len, batch_size, k, p, op, dtype):
 
     scale = 3
     device = "cuda"
-    query = torch.randn((batch_size, q_len, k), device=device, dtype=dtype) * scale
-    key = torch.randn((batch_size, kv_len, k), device=device, dtype=dtype) * scale
-    value = torch.randn((batch_size, kv_len, k), device=device, dtype=dtype) * scale
+    query = torch.normal(0.0, scale, (batch_size, q_len, k), device=device, dtype=dtype)
+    key = torch.normal(0.0, scale, (batch_size, kv_len, k), device=device, dtype=dtype)
+    value = torch.normal(
+        0.0, scale, (batch_size, kv_len, k), device=device, dtype=dtype
+    )
 
     query.requires_grad_(True)
     key.requires_grad_(True)
@@ -1068,9 +1236,9 @@ def test_memory_efficient_attention_full_block_masked(q_len, kv_len, batch_size,
     op_bw = fmha.small_k.BwOp
 
     scale = 3
-    query = torch.randn((batch_size, q_len, k_len), device=device) * scale
-    key = torch.randn((batch_size, kv_len, k_len), device=device) * scale
-    value = torch.randn((batch_size, kv_len, k_len), device=device) * scale
+    query = torch.normal(0.0, scale, (batch_size, q_len, k_len), device=device)
+    key = torch.normal(0.0, scale, (batch_size, kv_len, k_len), device=device)
+    value = torch.normal(0.0, scale, (batch_size, kv_len, k_len), device=device)
 
     # in this case, most of the blocks in a row get masked
     attn_bias = torch.full((3, 32), float("-inf"), device=device)
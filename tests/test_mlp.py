@@ -0,0 +1,110 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+import torch
+
+from xformers.components import Activation
+from xformers.components.feedforward import build_feedforward
+from xformers.components.feedforward.mlp import _Int8Linear
+
+BATCH = 4
+SEQ = 256
+LATENT = 128
+DROPOUT = 0.5
+
+DEVICES = (
+    [torch.device("cpu")] if not torch.cuda.is_available() else [torch.device("cuda")]
+)
+
+
+def _build_mlp(
+    activation: Activation, device: torch.device, dim_model: int = LATENT
+) -> torch.nn.Module:
+    test_config = {
+        "name": "MLP",
+        "dim_model": dim_model,
+        "dropout": DROPOUT,
+        "activation": activation,
+        "hidden_layer_multiplier": 4,
+    }
+    torch.manual_seed(0)
+    return build_feedforward(test_config).to(device).eval()
+
+
+@pytest.mark.parametrize("mode", ["bf16", "int8"])
+@pytest.mark.parametrize("device", DEVICES)
+def test_mlp_to_quantized(mode: str, device: torch.device):
+    ffw = _build_mlp(Activation.GeLU, device)
+    inputs = torch.rand(BATCH, SEQ, LATENT, device=device)
+    ref = ffw(inputs)
+
+    if mode == "int8" and device.type != "cpu":
+        # There is no int8 matmul kernel to use
+        with pytest.raises(ValueError):
+            ffw.to_quantized(mode)
+        return
+
+    ffw.to_quantized(mode)
+    if mode == "bf16":
+        inputs = inputs.bfloat16()
+    outputs = ffw(inputs)
+
+    assert outputs.dtype == inputs.dtype
+    assert torch.allclose(outputs.float(), ref, atol=2e-2, rtol=2e-2)
+
+
+def test_mlp_to_quantized_unaligned():
+    # The int8 kernel needs in_features to be a multiple of 16
+    ffw = _build_mlp(Activation.GeLU, torch.device("cpu"), dim_model=40)
+    with pytest.raises(ValueError):
+        ffw.to_quantized("int8")
+    assert all(isinstance(layer, torch.nn.Linear) for layer in ffw.mlp[::3])
+
+
+@pytest.mark.parametrize("device", DEVICES)
+def test_mlp_sparse_ffn(device: torch.device):
+    ffw = _build_mlp(Activation.ReLU, device)
+    inputs = torch.rand(BATCH, SEQ, LATENT, device=device)
+    ref = ffw(inputs)
+
+    with torch.no_grad():
+        # Keeping all the hidden activations is exact
+        ffw.enable_sparse_ffn(4 * LATENT)
+        assert torch.allclose(ffw(inputs), ref, atol=1e-5, rtol=1e-5)
+
+        # Fewer activations only approximate the MLP, and only at inference
+        ffw.enable_sparse_ffn(LATENT)
+        assert ffw(inputs).shape == ref.shape
+
+    # The dense path is used whenever gradients are needed
+    assert torch.equal(ffw(inputs), ffw.mlp(inputs))
+    ffw.train()
+    torch.manual_seed(0)
+    outputs = ffw(inputs)
+    torch.manual_seed(0)
+    assert torch.equal(outputs, ffw.mlp(inputs))
+
+    ffw.enable_sparse_ffn(None)
+    assert torch.allclose(ffw.eval()(inputs), ref)
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+@pytest.mark.parametrize("in_features", [64, 40])
+def test_int8_linear(in_features: int, dtype: torch.dtype):
+    torch.manual_seed(0)
+    linear = torch.nn.Linear(in_features, 24)
+    int8_linear = _Int8Linear(linear)
+    inputs = torch.randn(3, 5, in_features)
+
+    # Same as dequantizing the weights, whether the int8 kernel is used or not
+    weight = int8_linear.weight.float() * int8_linear.scale[:, None]
+    ref = torch.nn.functional.linear(inputs, weight, linear.bias)
+    outputs = int8_linear(inputs.to(dtype))
+
+    assert outputs.dtype == dtype
+    assert outputs.shape == ref.shape
+    tol = 1e-5 if dtype == torch.float32 else 5e-2
+    assert torch.allclose(outputs.float(), ref, atol=tol, rtol=tol)
@@ -7,7 +7,8 @@
 import pytest
 import torch
 
-from xformers.components import NormalizationType, PreNorm
+from xformers import _is_triton_available
+from xformers.components import NormalizationType, PostNorm, PreNorm, Residual
 
 
 class Passthrough(torch.nn.Module):
@@ -30,5 +31,34 @@ def test_pre_norm(normalization):
 
     assert id(outputs[0]) == id(outputs[1])
 
+    # Same with only some of the inputs being repeated, as in cross-attention
+    y = torch.rand((3, 3))
+    outputs_cross = wrap(inputs=[x, x, y])
+    assert id(outputs_cross[0]) == id(outputs_cross[1])
+    assert id(outputs_cross[0]) != id(outputs_cross[2])
+    assert torch.equal(outputs_cross[0], outputs[0])
+
     # Check the BW pass
     torch.sum(outputs[0]).backward()
+
+
+@pytest.mark.skipif(not _is_triton_available(), reason="requires triton")
+@pytest.mark.parametrize("dtype", [torch.float16, torch.bfloat16])
+def test_post_norm_fused_residual(dtype):
+    # In inference, the residual sum and the LayerNorm are fused
+    torch.manual_seed(0)
+    x = torch.randn((4, 16, 384), device="cuda", dtype=dtype)
+
+    sublayer = Residual(layer=torch.nn.Linear(384, 384))
+    wrap = PostNorm(
+        d_norm=384, sublayer=sublayer, normalization=NormalizationType.LayerNorm
+    )
+    wrap = wrap.to(device="cuda", dtype=dtype)
+    torch.nn.init.normal_(wrap.norm.weight)
+    torch.nn.init.normal_(wrap.norm.bias)
+
+    with torch.no_grad():
+        fused = wrap(inputs=[x])
+        ref = wrap.norm(sublayer(inputs=[x]))
+
+    torch.testing.assert_close(fused, ref, atol=1e-2, rtol=1e-2)
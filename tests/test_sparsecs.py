@@ -7,8 +7,8 @@ import pytest
 import torch
 
 from xformers.components.attention import maybe_sparsify
-from xformers.components.attention._sputnik_sparse import _dense_to_sparse
-from xformers.components.attention.core import SparseCS, _create_random_sparsity
+from xformers.components.attention._sputnik_sparse import SparseCS, _dense_to_sparse
+from xformers.components.attention.core import _create_random_sparsity
 
 B = 2
 M = 16  # not a nice round number, on purpose
@@ -58,6 +58,22 @@ def test_device(device):
     assert sparse_mask.device.type == device.type
 
 
+@pytest.mark.parametrize("device", _devices)
+def test_with_values(device):
+    matrix = _create_random_sparsity(torch.rand(B, M, M, device=device), 0.5)
+    matrix_cs = SparseCS(matrix, device)
+
+    doubled = matrix_cs.with_values(matrix_cs.values * 2)
+    assert doubled.shape == matrix_cs.shape
+    assert doubled.column_indices is matrix_cs.column_indices
+    assert torch.allclose(doubled.to_dense(), 2 * matrix_cs.to_dense())
+
+    # SparseCS only holds its underlying sparse matrix
+    assert not hasattr(doubled, "__dict__")
+    with pytest.raises(AttributeError):
+        doubled.foo = 1  # type: ignore
+
+
 def _baseline_dense_to_sparse(matrix):
     import numpy as np
 
@@ -476,3 +476,18 @@ def test_autocast_silu_bw_fused_compile() -> None:
         assert_allclose(
             a, b, msg="fw", atol=FORWARD_ATOL[dtype], rtol=FORWARD_RTOL[dtype]
         )
+
+
+@pytest.mark.parametrize("bias", [False, True], ids=["nobias", "bias"])
+def test_eager_packed_weights(bias: bool) -> None:
+    torch.manual_seed(0)
+    module = xsw.SwiGLU(64, 96, bias=bias, _pack_weights=True)
+    x = torch.randn([3, 5, 64])
+
+    # On CPU, the eager op computes the packed w1/w2 with a single GEMM
+    w1, b1, w2, b2, w3, b3 = module._ordered_params()
+    x1 = torch.nn.functional.linear(x, w1, b1)
+    x2 = torch.nn.functional.linear(x, w2, b2)
+    ref = torch.nn.functional.linear(torch.nn.functional.silu(x1) * x2, w3, b3)
+
+    assert_allclose(module(x), ref, atol=FORWARD_ATOL[torch.float], rtol=1e-5)
@@ -3,8 +3,9 @@
 # This source code is licensed under the BSD license found in the
 # LICENSE file in the root directory of this source tree.
 
+from contextlib import contextmanager
 from functools import wraps
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple
 
 import numpy as np
 import pytest
@@ -21,30 +22,51 @@ disable_on_rocm = pytest.mark.skipif(
 )
 
 
+@contextmanager
+def no_tf32() -> Iterator[None]:
+    cuda, cudnn = (
+        torch.backends.cuda.matmul.allow_tf32,
+        torch.backends.cudnn.allow_tf32,
+    )
+    torch.backends.cuda.matmul.allow_tf32, torch.backends.cudnn.allow_tf32 = (
+        False,
+        False,
+    )
+    try:
+        yield
+    finally:
+        torch.backends.cuda.matmul.allow_tf32, torch.backends.cudnn.allow_tf32 = (
+            cuda,
+            cudnn,
+        )
+
+
 def disable_tf32(fn):
     @wraps(fn)
     def wrapped(*args, **kwargs):
-        cuda, cudnn = (
-            torch.backends.cuda.matmul.allow_tf32,
-            torch.backends.cudnn.allow_tf32,
-        )
-        torch.backends.cuda.matmul.allow_tf32, torch.backends.cudnn.allow_tf32 = (
-            False,
-            False,
-        )
-        try:
+        with no_tf32():
             return fn(*args, **kwargs)
-        finally:
-            torch.backends.cuda.matmul.allow_tf32, torch.backends.cudnn.allow_tf32 = (
-                cuda,
-                cudnn,
-            )
 
     return wrapped
 
 
-ref_attention_for_test = disable_tf32(ref_attention)
-ref_attention_bmhk_for_test = disable_tf32(ref_attention_bmhk)
+# Number of keys the reference attention processes at once. Set to `None` by
+# `pytest --slow-ref`, to materialize the whole attention matrix instead
+REF_KV_BLOCK_SIZE: Optional[int] = 256
+
+
+@disable_tf32
+def ref_attention_for_test(q, k, v, attn_bias=None, drop_mask=None, p=0.0, scale=None):
+    return ref_attention(
+        q, k, v, attn_bias, drop_mask, p, scale, kv_block_size=REF_KV_BLOCK_SIZE
+    )
+
+
+@disable_tf32
+def ref_attention_bmhk_for_test(q, k, v, attn_bias, scale=None):
+    return ref_attention_bmhk(
+        q, k, v, attn_bias, scale=scale, kv_block_size=REF_KV_BLOCK_SIZE
+    )
 
 
 def assert_allclose(
@@ -61,6 +83,9 @@ def assert_allclose(
         assert False, f"out dtype: {out.dtype}, ref dtype: {ref.dtype}"
     if out.numel() == 0:
         return
+    if torch.allclose(out, ref, rtol=rtol, atol=atol):
+        return
+    # Only build the (full-size) diagnostic tensors when the check fails
     flatten_diff = ((out - ref).abs() - atol - ref.abs() * rtol).flatten()
     max_pos = flatten_diff.argmax()
     max_location = np.unravel_index(int(max_pos), out.shape)
@@ -68,7 +93,7 @@ def assert_allclose(
     num_different = flatten_diff.numel() - torch.count_nonzero(flatten_diff <= 0)
     percentage = num_different / flatten_diff.numel()
     del flatten_diff
-    assert torch.allclose(out, ref, rtol=rtol, atol=atol), (
+    assert False, (
         f"{msg}: "
         f"out={out.flatten()[max_pos]} and ref={ref.flatten()[max_pos]} (diff={max_diff} > 0)"
         f" at {max_location} of shape {tuple(out.shape)} / atol={atol}, rtol={rtol}"
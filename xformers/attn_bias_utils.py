@@ -28,6 +28,80 @@ def _create_aligned_bias(*shape: int, **kwargs) -> torch.Tensor:
     ).narrow(-1, 0, shape[-1])
 
 
+def _create_tensor_bias(
+    batch_size: int,
+    num_heads: int,
+    num_heads_groups: int,
+    q_len: int,
+    kv_len: int,
+    device,
+    dtype,
+    fmt: str,
+    op: Optional[Type[AttentionOpBase]],
+    requires_grad: bool,
+) -> torch.Tensor:
+    """
+    Dense bias for `create_attn_bias(torch.Tensor, ...)`. It is drawn from a
+    generator seeded by its arguments, so that it does not depend on which call
+    creates it.
+    """
+    seed = random.Random(
+        "-".join(
+            map(
+                str,
+                [batch_size, num_heads, num_heads_groups, q_len, kv_len, dtype, fmt],
+            )
+        )
+    ).getrandbits(63)
+    generator = torch.Generator(device=device).manual_seed(seed)
+    if fmt == "BMK":
+        batch_size *= num_heads
+        num_heads = 1
+    # `small_k` only supports an expanded 1d bias
+    if op in [fmha.small_k.FwOp, fmha.small_k.BwOp]:
+        attn_bias = (
+            torch.randn(
+                (batch_size, num_heads, 1, kv_len),
+                device=device,
+                dtype=dtype,
+                generator=generator,
+            )
+            * 3
+        )
+        attn_bias = attn_bias.expand(batch_size, num_heads, q_len, kv_len)
+    elif op is not None and issubclass(op, fmha.triton_splitk.FwOp):
+        attn_bias = (
+            torch.randn(
+                (batch_size, num_heads_groups, num_heads, q_len, kv_len),
+                device=device,
+                dtype=dtype,
+                generator=generator,
+            )
+            * 3
+        )
+        if fmt in ["BMK", "BMHK"]:
+            attn_bias = attn_bias[:, 0]
+    else:
+        attn_bias = _create_aligned_bias(
+            batch_size,
+            num_heads_groups,
+            num_heads,
+            q_len,
+            kv_len,
+            device=device,
+            dtype=dtype,
+            generator=generator,
+        )
+
+        # make sure it also works if the first columns/rows are partially masked out
+        attn_bias[0, 0, 0, : q_len - 1, : kv_len - 1] = -math.inf
+        if fmt in ["BMK", "BMHK"]:
+            attn_bias = attn_bias[:, 0]
+    if requires_grad:
+        attn_bias.requires_grad_(True)
+    return attn_bias
+
+
 def create_attn_bias(
     bias_type,
     batch_size: int,
@@ -47,47 +121,18 @@ def create_attn_bias(
     r = random.Random("-".join(map(str, [batch_size, q_len, kv_len, dtype, fmt])))
     window_size = {0: 3, 1: 128, 2: 300}[r.randint(0, 2)]
     if bias_type is torch.Tensor:
-        if fmt == "BMK":
-            batch_size *= num_heads
-            num_heads = 1
-        # `small_k` only supports an expanded 1d bias
-        if op in [fmha.small_k.FwOp, fmha.small_k.BwOp]:
-            attn_bias = (
-                torch.randn(
-                    (batch_size, num_heads, 1, kv_len), device=device, dtype=dtype
-                )
-                * 3
-            )
-            attn_bias = attn_bias.expand(batch_size, num_heads, q_len, kv_len)
-        elif op is not None and issubclass(op, fmha.triton_splitk.FwOp):
-            attn_bias = (
-                torch.randn(
-                    (batch_size, num_heads_groups, num_heads, q_len, kv_len),
-                    device=device,
-                    dtype=dtype,
-                )
-                * 3
-            )
-            if fmt in ["BMK", "BMHK"]:
-                attn_bias = attn_bias[:, 0]
-        else:
-            attn_bias = _create_aligned_bias(
-                batch_size,
-                num_heads_groups,
-                num_heads,
-                q_len,
-                kv_len,
-                device=device,
-                dtype=dtype,
-            )
-
-            # make sure it also works if the first columns/rows are partially masked out
-            attn_bias[0, 0, 0, : q_len - 1, : kv_len - 1] = -math.inf
-            if fmt in ["BMK", "BMHK"]:
-                attn_bias = attn_bias[:, 0]
-
-        if requires_grad:
-            attn_bias.requires_grad_(True)
+        attn_bias = _create_tensor_bias(
+            batch_size,
+            num_heads,
+            num_heads_groups,
+            q_len,
+            kv_len,
+            device,
+            dtype,
+            fmt,
+            op,
+            requires_grad=requires_grad,
+        )
         if fmt == "BMK":
             attn_bias = attn_bias[:, 0]
         return attn_bias
@@ -358,7 +403,92 @@ def _rand_seqlens_padded_k(
     return q_seqlens, k_seqlens
 
 
-def ref_attention(q, k, v, attn_bias=None, drop_mask=None, p=0.0, scale=None):
+def _scaled_qk(
+    q: torch.Tensor, k: torch.Tensor, scale: float, bias: Optional[torch.Tensor] = None
+) -> torch.Tensor:
+    # `bias + scale * q @ k.T` as a single GEMM, the scale and bias being
+    # applied in its epilogue rather than as separate passes
+    if bias is None:
+        return torch.baddbmm(
+            q.new_zeros(()), q, k.transpose(-2, -1), beta=0.0, alpha=scale
+        )
+    return torch.baddbmm(bias, q, k.transpose(-2, -1), alpha=scale)
+
+
+def _ref_attention_scores(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    scale: float,
+    attn_bias: Optional[torch.Tensor] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    attn_bias = None if attn_bias is None else attn_bias.float()
+    return _scaled_qk(q.float(), k.float(), scale, attn_bias), v.float()
+
+
+def _ref_attention_inputs(
+    q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, scale: float
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    return q.float() * scale, k.float(), v.float()
+
+
+def _ref_attention_tiled(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    attn_bias: Optional[torch.Tensor],
+    drop_mask: Optional[torch.Tensor],
+    p: float,
+    scale: float,
+    kv_block_size: int,
+) -> torch.Tensor:
+    """
+    Streams over blocks of keys with an online softmax, so that at most
+    `[B, Mq, kv_block_size]` scores are live at once instead of `[B, Mq, Mkv]`
+    """
+    q, k, v = _ref_attention_inputs(q, k, v, scale)
+    row_max = q.new_full([q.shape[0], q.shape[1], 1], -math.inf)
+    row_sum = q.new_zeros([q.shape[0], q.shape[1], 1])
+    out = q.new_zeros([q.shape[0], q.shape[1], v.shape[-1]])
+    for start in range(0, k.shape[1], kv_block_size):
+        end = min(start + kv_block_size, k.shape[1])
+        # q is already scaled
+        attn = _scaled_qk(
+            q,
+            k[:, start:end],
+            1.0,
+            None if attn_bias is None else attn_bias[..., start:end].float(),
+        )
+        new_max = torch.maximum(row_max, attn.amax(-1, keepdim=True))
+        # Rows which are entirely masked so far: avoid `-inf - (-inf)`, but keep
+        # their running max at -inf so that the next blocks do not underflow
+        safe_max = torch.where(new_max == -math.inf, 0.0, new_max)
+        correction = torch.exp(row_max - safe_max)
+        attn = torch.exp(attn - safe_max)
+        row_sum = row_sum * correction + attn.sum(-1, keepdim=True)
+        if drop_mask is not None:
+            attn = attn * (drop_mask[..., start:end] / (1 - p))
+        out = out * correction + attn @ v[:, start:end]
+        row_max = new_max
+    # Fully masked rows give NaNs, like `softmax` does
+    return out / row_sum
+
+
+def ref_attention(
+    q,
+    k,
+    v,
+    attn_bias=None,
+    drop_mask=None,
+    p=0.0,
+    scale=None,
+    kv_block_size: Optional[int] = None,
+):
+    """
+    Reference attention, computed in fp32.
+    If `kv_block_size` is set, keys are processed in blocks of this size with
+    an online softmax rather than materializing the full attention matrix.
+    """
     if q.ndim == 5:
 
         def attn_bias_group(group: int):
@@ -377,6 +507,7 @@ def ref_attention(q, k, v, attn_bias=None, drop_mask=None, p=0.0, scale=None):
                     v[:, :, g],
                     scale=scale,
                     attn_bias=attn_bias_group(g),
+                    kv_block_size=kv_block_size,
                 )
                 for g in range(q.shape[2])
             ],
@@ -384,15 +515,11 @@ def ref_attention(q, k, v, attn_bias=None, drop_mask=None, p=0.0, scale=None):
         )
     if q.ndim == 4:
         assert p == 0.0
-        return ref_attention_bmhk(q, k, v, scale=scale, attn_bias=attn_bias)
-    q = q.float()
-    k = k.float()
-    v = v.float()
-
+        return ref_attention_bmhk(
+            q, k, v, scale=scale, attn_bias=attn_bias, kv_block_size=kv_block_size
+        )
     scale = scale if scale is not None else (1 / q.shape[-1] ** 0.5)
-    q = q * scale
-
-    attn = q @ k.transpose(-2, -1)
+    attn_bias_tensor = None
     if attn_bias is not None:
         if isinstance(attn_bias, (AttentionBias, AttentionBiasSubTensor)):
             # Always create in B,H,Mq,Mk format
@@ -408,14 +535,20 @@ def ref_attention(q, k, v, attn_bias=None, drop_mask=None, p=0.0, scale=None):
             attn_bias_tensor = attn_bias_tensor.reshape(
                 [-1, *attn_bias_tensor.shape[2:]]
             )
-        attn = attn + attn_bias_tensor.float()
+    if kv_block_size is not None:
+        return _ref_attention_tiled(
+            q, k, v, attn_bias_tensor, drop_mask, p, scale, kv_block_size
+        )
+    attn, v = _ref_attention_scores(q, k, v, scale, attn_bias_tensor)
     attn = attn.softmax(-1)
     if drop_mask is not None:
         attn = attn * (drop_mask / (1 - p))
     return attn @ v
 
 
-def ref_attention_bmhk(q, k, v, attn_bias, scale=None) -> torch.Tensor:
+def ref_attention_bmhk(
+    q, k, v, attn_bias, scale=None, kv_block_size: Optional[int] = None
+) -> torch.Tensor:
     assert q.ndim == 4
 
     def T(t):
@@ -429,6 +562,8 @@ def ref_attention_bmhk(q, k, v, attn_bias, scale=None) -> torch.Tensor:
             device=q.device,
             dtype=torch.float32,
         ).reshape([q.shape[0] * q.shape[2], q.shape[1], k.shape[1]])
-    out = ref_attention(T(q), T(k), T(v), attn_bias, scale=scale)
+    out = ref_attention(
+        T(q), T(k), T(v), attn_bias, scale=scale, kv_block_size=kv_block_size
+    )
     out = out.reshape([q.shape[0], q.shape[2], q.shape[1], v.shape[3]])
     return out.permute((0, 2, 1, 3))
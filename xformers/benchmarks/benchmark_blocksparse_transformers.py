@@ -598,9 +598,6 @@ class Experiment:
             except RuntimeError:
                 pass
             except AssertionError:
-                import pdb
-
-                pdb.set_trace()
                 raise
 
 
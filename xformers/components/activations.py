@@ -5,6 +5,7 @@
 
 
 from enum import Enum
+from functools import partial
 from typing import Optional
 
 import torch
@@ -14,6 +15,7 @@ from torch import nn
 class Activation(str, Enum):
     SquaredReLU = "squared_relu"
     GeLU = "gelu"
+    GeLUTanh = "gelu_tanh"
     LeakyReLU = "leaky_relu"
     ReLU = "relu"
     SmeLU = "smelu"
@@ -27,7 +29,10 @@ class SquaredReLU(nn.Module):
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         x_ = torch.nn.functional.relu(x)
-        return x_ * x_
+        if torch.is_grad_enabled() and x_.requires_grad:
+            # ReLU's backward needs its output untouched
+            return x_.square()
+        return x_.square_()
 
 
 class StarReLU(nn.Module):
@@ -45,27 +50,27 @@ class SmeLU(nn.Module):
         self.beta = beta
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        relu = torch.where(
-            x >= self.beta,
-            x,
-            torch.tensor([0.0], device=x.device, dtype=x.dtype),
-        )
+        # Outside of [-beta, beta], SmeLU matches ReLU
         return torch.where(
             torch.abs(x) <= self.beta,
-            ((x + self.beta) ** 2).type_as(x) / (4.0 * self.beta),
-            relu,
+            (x + self.beta).square() * (0.25 / self.beta),
+            torch.nn.functional.relu(x),
         )
 
 
-def build_activation(activation: Optional[Activation]):
+_ACTIVATIONS = {
+    Activation.ReLU: nn.ReLU,
+    Activation.GeLU: nn.GELU,
+    Activation.GeLUTanh: partial(nn.GELU, approximate="tanh"),
+    Activation.LeakyReLU: nn.LeakyReLU,
+    Activation.SquaredReLU: SquaredReLU,
+    Activation.StarReLU: StarReLU,
+    Activation.SmeLU: SmeLU,
+}
+
+
+def build_activation(activation: Optional[Activation]) -> nn.Module:
     if not activation:
         return nn.Identity()
 
-    return {
-        Activation.ReLU: nn.ReLU,
-        Activation.GeLU: nn.GELU,
-        Activation.LeakyReLU: nn.LeakyReLU,
-        Activation.SquaredReLU: SquaredReLU,
-        Activation.StarReLU: StarReLU,
-        Activation.SmeLU: SmeLU,
-    }[activation]()
+    return _ACTIVATIONS[activation]()
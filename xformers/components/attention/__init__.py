@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+import os
 from pathlib import Path
 from typing import Any, Callable, Dict, Set, Union
 
@@ -44,7 +45,7 @@ def build_attention(config: Union[Dict[str, Any], AttentionConfig]):
     if not isinstance(config, AttentionConfig):
         try:
             config_instance = generate_matching_config(
-                config, ATTENTION_REGISTRY[config["name"]].config
+                config, _lookup_attention(config["name"]).config
             )
         except KeyError as e:
             name = config["name"]
@@ -53,11 +54,18 @@ def build_attention(config: Union[Dict[str, Any], AttentionConfig]):
     else:
         config_instance = config
 
-    return ATTENTION_REGISTRY[config_instance.name].constructor.from_config(
+    return _lookup_attention(config_instance.name).constructor.from_config(
         config_instance
     )
 
 
+def _lookup_attention(name: str) -> Any:
+    if name not in ATTENTION_REGISTRY:
+        # Not registered yet if XFORMERS_EAGER_IMPORT=0
+        _import_all_attentions()
+    return ATTENTION_REGISTRY[name]
+
+
 """Registers an Attention subclass.
 
     This decorator allows xFormers to instantiate a subclass of Attention
@@ -92,7 +100,7 @@ def maybe_sparsify(matrix) -> Any:
 
 def sparsify(matrix):
     if _USE_SPUTNIK:
-        return SparseCS(matrix)
+        return SparseCS(matrix, matrix.device)
     return matrix.to_sparse()
 
 
@@ -129,5 +137,18 @@ except ImportError:
     pass
 
 
-# automatically import any Python files in the directory
-import_all_modules(str(Path(__file__).parent), "xformers.components.attention")
+_all_attentions_imported = False
+
+
+def _import_all_attentions() -> None:
+    # Import any Python files in the directory, so that they all register themselves
+    global _all_attentions_imported
+    if not _all_attentions_imported:
+        import_all_modules(str(Path(__file__).parent), "xformers.components.attention")
+        _all_attentions_imported = True
+
+
+# Set XFORMERS_EAGER_IMPORT=0 to only register the attentions above for now,
+# the others are imported on the first lookup of an attention which is not registered
+if os.environ.get("XFORMERS_EAGER_IMPORT", "1") == "1":
+    _import_all_attentions()
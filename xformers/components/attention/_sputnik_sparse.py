@@ -14,6 +14,8 @@ from xformers.sparse.utils import _csr_to_coo, _dense_to_sparse  # noqa: F401
 
 
 class SparseCS:
+    __slots__ = ("_mat",)
+
     def __init__(self, matrix, device=None):
         if device is None:
             device = torch.device("cpu")
@@ -81,6 +83,19 @@ class SparseCS:
         matrix._mat = csr_matrix
         return matrix
 
+    def with_values(self, values):
+        """Same sparsity pattern (sharing the index tensors), with new values"""
+        mat = self._mat
+        csr_matrix = SparseCSRTensor._wrap(
+            mat.shape,
+            values,
+            mat._csr_row_indices,
+            mat._csr_row_offsets,
+            mat._csr_column_indices,
+            mat._csr_transp_info,
+        )
+        return type(self)._wrap(csr_matrix)
+
     def __mul__(self, other):
         assert isinstance(other, (int, float))
         return type(self)._wrap(self._mat * other)
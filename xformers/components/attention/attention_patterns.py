@@ -5,7 +5,7 @@
 
 
 import math
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 import torch
@@ -88,12 +88,16 @@ def random_pattern(attn_size: int, sparsity: float) -> torch.Tensor:
 
 
 # 1d-specific cases
-def local_1d_pattern(attn_size: int, window_size: int) -> torch.Tensor:
+def local_1d_pattern(
+    attn_size: int, window_size: int, device: Optional[torch.device] = None
+) -> torch.Tensor:
     assert (
         window_size % 2 == 1
     ), "The window size is assumed to be odd (counts self-attention + 2 wings)"
-    h_win_size = window_size // 2 + 1
-    return local_nd_pattern(attn_size, distance=h_win_size, p=1.0)
+    # Band of half-width window_size // 2 around the diagonal, built in place
+    h_win_size = window_size // 2
+    mask = torch.ones(attn_size, attn_size, dtype=torch.bool, device=device)
+    return mask.tril_(h_win_size).triu_(-h_win_size)
 
 
 def causal_1d_pattern(attn_size: int) -> torch.Tensor:
@@ -29,15 +29,14 @@ logger = logging.getLogger("xformers")
 def _create_random_sparsity(matrix, sparsity, divisible_by=4):
     assert matrix.ndim == 3
     keep = torch.rand_like(matrix[0], dtype=torch.float32) > sparsity
-    nonzero = torch.nonzero(keep)
-    nnz = nonzero.shape[0]
     # NOTE: need to make it a multiple of 4 for sputnik
-    nonzero = nonzero[: (nnz - nnz % divisible_by)]
-    i, j = nonzero.unbind(1)
-    output = torch.zeros_like(matrix)
-    bdim = torch.arange(matrix.shape[0], device=matrix.device)[:, None]
-    output[bdim, i, j] = matrix[bdim, i, j]
-    return output
+    # Drop the last kept elements (in row-major order) past that multiple,
+    # without syncing on the number of nonzeros
+    kept_so_far = keep.flatten().cumsum(0)
+    nnz = kept_so_far[-1]
+    keep &= (kept_so_far <= nnz - nnz % divisible_by).view_as(keep)
+    # The same pattern is used for every element of the batch
+    return matrix.masked_fill(~keep, 0)
 
 
 def _broadcast_batch(mask, batch_size):
@@ -49,32 +48,46 @@ def _broadcast_batch(mask, batch_size):
     values = mask.values()
     indices = mask.indices()
     nnz = len(values)
-    # strategy: repeat the indices and append the extra batch dimension to the indices
-    indices = indices.repeat(1, batch_size)
-    # now create the batch indices
-    batch_indices = torch.arange(batch_size, device=indices.device)
-    batch_indices = batch_indices[:, None].expand(batch_size, nnz).flatten()
-
-    # put them together
-    indices = torch.cat([batch_indices[None, :], indices], dim=0)
+    # strategy: fill a single (3, B, nnz) buffer, the batch index in the first row
+    # and the 2D indices broadcast over the batch in the other two
+    batch_indices = indices.new_empty((3, batch_size, nnz))
+    batch_indices[0] = torch.arange(batch_size, device=indices.device)[:, None]
+    batch_indices[1:] = indices[:, None, :]
+    indices = batch_indices.view(3, -1)
 
     # now repeat the values
-    values = values.repeat(batch_size)
+    values = values.expand(batch_size, nnz).reshape(-1)
 
     size = (batch_size,) + mask.shape
 
     return torch.sparse_coo_tensor(indices, values, size)
 
 
+def _scaled_matmul(a: torch.Tensor, b: torch.Tensor, scale: float) -> torch.Tensor:
+    if scale == 1.0:
+        return a @ b
+
+    if a.ndim == b.ndim == 3 and a.shape[0] == b.shape[0]:
+        # Let the GEMM apply the scale, instead of a separate pass over the inputs
+        return torch.baddbmm(a.new_zeros(()), a, b, beta=0.0, alpha=scale)
+
+    return (a * scale) @ b
+
+
 def _matmul_with_mask(
     a: torch.Tensor,
     b: torch.Tensor,
     mask: Optional[Union[torch.Tensor, "SparseCS"]],
+    scale: float = 1.0,
 ) -> torch.Tensor:
     if mask is None:
-        return a @ b
+        return _scaled_matmul(a, b, scale)
 
     if _has_cpp_library and mask.dtype == torch.bool:
+        # The sparse kernels do not take a scale
+        if scale != 1.0:
+            a = a * scale
+
         if isinstance(mask, SparseCS):
             return mask.matmul_with_mask(a, b)
         if mask.is_sparse:
@@ -90,13 +103,11 @@ def _matmul_with_mask(
     if _has_cpp_library:
         assert not isinstance(mask, SparseCS)
 
-    att = a @ b
+    att = _scaled_matmul(a, b, scale)
     if mask.dtype == torch.bool:
         assert not isinstance(mask, SparseCS)
-        if mask.ndim == 2:
-            mask = mask.unsqueeze(0).expand(att.shape[0], -1, -1)
-        # mask is presumed false == ignore
-        att[~mask] = float("-inf")
+        # mask is presumed false == ignore, a 2D mask is broadcast over the batch
+        att.masked_fill_(~mask, float("-inf"))
     else:
         # mask is presumed additive
         # repeat if batch sizes don't match
@@ -107,8 +118,12 @@ def _matmul_with_mask(
             and (att.shape[0] % mask.shape[0]) == 0
         ):
             repeat_factor = att.shape[0] // mask.shape[0]
-            mask = mask.repeat([repeat_factor, 1, 1])
             logger.info("Mismatched batch dimensions for mask, repeating mask.")
+            if not mask.is_sparse:
+                # Same as adding the repeated mask, without materializing it
+                att.view(repeat_factor, *mask.shape).add_(mask)
+                return att
+            mask = mask.repeat([repeat_factor, 1, 1])
         att += mask
     return att
 
@@ -175,16 +190,7 @@ def _apply_dropout(att, dropout):
     # Dropout chokes on sparse tensors
     if _has_cpp_library:
         if isinstance(att, SparseCS):
-            values = att.values.clone()
-            values = dropout(values)
-            att = SparseCS.wrap(
-                att.shape,
-                values,
-                att.row_indices,
-                att.row_offsets,
-                att.column_indices,
-                att._transp_info,
-            )
+            att = att.with_values(dropout(att.values.clone()))
         elif att.is_sparse:
             att = att.coalesce()
             values = att.values().clone()  # protect against in-place dropout
@@ -210,7 +216,8 @@ def scaled_query_key_softmax(
     # this is needed due to limitations in sparse_bmm for now
 
     # Self-attend: (N, S, hs) x (N, hs, S) -> (N, S, S)
-    q = q / math.sqrt(k.size(-1))
+    # the 1/sqrt(hs) scaling is applied by the matmul itself
+    scale = 1 / math.sqrt(k.size(-1))
 
     # Matmul with mask
     if att_mask is not None and isinstance(att_mask, AttentionMask):
@@ -219,7 +226,7 @@ def scaled_query_key_softmax(
     else:
         mask = att_mask
 
-    att = _matmul_with_mask(q, k.transpose(-2, -1), mask)
+    att = _matmul_with_mask(q, k.transpose(-2, -1), mask, scale=scale)
 
     # Softmax to get the attention probabilities
     is_causal = isinstance(att_mask, AttentionMask) and att_mask.is_causal
@@ -284,6 +291,40 @@ def blocksparse_attention(
     return att
 
 
+def _fused_dense_attention(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    att_mask: Optional[Union[AttentionMask, torch.Tensor]],
+    dropout: Optional[torch.nn.Module],
+) -> Optional[torch.Tensor]:
+    """
+    Dense attention through PyTorch's fused kernels, which do not materialize the
+    (S, S) attention matrix. Returns None if the inputs are not supported.
+
+    Dropout is sampled by the fused kernel itself, so for a given seed the dropped
+    entries differ from the ones of the unfused path.
+    """
+    if dropout is None:
+        p = 0.0
+    elif type(dropout) is torch.nn.Dropout:
+        p = dropout.p if dropout.training else 0.0
+    else:
+        return None
+
+    mask = att_mask.values if isinstance(att_mask, AttentionMask) else att_mask
+    if mask is not None:
+        # Mismatched batch dimensions are handled by the generic path
+        if q.ndim != 3 or (mask.ndim == 3 and mask.shape[0] not in (1, q.shape[0])):
+            return None
+        if mask.dtype != torch.bool:
+            mask = mask.to(q.dtype)
+
+    return torch.nn.functional.scaled_dot_product_attention(
+        q, k, v, attn_mask=mask, dropout_p=p, scale=1 / math.sqrt(k.size(-1))
+    )
+
+
 def scaled_dot_product_attention(
     q: torch.Tensor,
     k: torch.Tensor,
@@ -317,6 +358,11 @@ def scaled_dot_product_attention(
         logger.info("Switching causal attention to Triton blocksparse...")
         return blocksparse_attention(q, k, v, dropout, block_size)
 
+    if not autocast_disabled:
+        y = _fused_dense_attention(q, k, v, att_mask, dropout)
+        if y is not None:
+            return y
+
     with torch.cuda.amp.autocast(enabled=False) if autocast_disabled else nullcontext():  # type: ignore
         if autocast_disabled:
             q, k, v = q.float(), k.float(), v.float()
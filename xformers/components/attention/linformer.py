@@ -53,17 +53,15 @@ class LinformerAttention(Attention):
     def forward(
         self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, *args, **kwargs
     ):
-        # Handle a smaller dimension than expected
-        padding = 0
-        if q.shape[1] < self.seq_len:
-            padding = self.seq_len - q.shape[1]
-            pad_dims = (0, 0, 0, padding)
-            q = torch.nn.functional.pad(q, pad_dims)
-            k = torch.nn.functional.pad(k, pad_dims)
-            v = torch.nn.functional.pad(v, pad_dims)
-
-        k_projected = self.E(k.transpose(-2, -1)).transpose(-2, -1)
-        v_projected = self.F(v.transpose(-2, -1)).transpose(-2, -1)
+        # Handle a smaller dimension than expected: zero padded rows would not contribute
+        # to the projections, so only use the matching slice of the projection weights
+        seq_len = k.shape[1]
+        k_projected = torch.nn.functional.linear(
+            k.transpose(-2, -1), self.E.weight[:, :seq_len]
+        ).transpose(-2, -1)
+        v_projected = torch.nn.functional.linear(
+            v.transpose(-2, -1), self.F.weight[:, :seq_len]
+        ).transpose(-2, -1)
 
         y = scaled_dot_product_attention(
             q=q, k=k_projected, v=v_projected, att_mask=None, dropout=self.attn_drop
@@ -71,4 +69,4 @@ class LinformerAttention(Attention):
 
         y = self.attn_drop(y)
 
-        return y[:, :-padding, :] if padding > 0 else y
+        return y
@@ -5,31 +5,104 @@
 
 
 from dataclasses import dataclass
-from typing import Optional, Union
+from functools import lru_cache
+from typing import Any, Optional, Union
 
 import torch
 import torch.nn as nn
 
 from xformers.components.attention import (
+    _DENSITY_THRESHOLD,
     Attention,
     AttentionConfig,
     AttentionMask,
-    maybe_sparsify,
     register_attention,
     sparsify,
 )
-from xformers.components.attention.attention_patterns import (
-    causal_1d_pattern,
-    local_1d_pattern,
-)
+from xformers.components.attention.attention_patterns import local_1d_pattern
 from xformers.components.attention.core import scaled_dot_product_attention
 
+try:
+    from torch.nn.attention.flex_attention import create_block_mask, flex_attention
+
+    _is_flex_available = True
+except ImportError:
+    _is_flex_available = False
+
+
+def _band_density(seq_len: int, half_width: int, causal: bool) -> float:
+    # Share of the (seq_len, seq_len) matrix covered by the band, without counting it
+    w = min(half_width, seq_len - 1)
+    off_diagonal = w * seq_len - w * (w + 1) // 2
+    nnz = seq_len + off_diagonal * (1 if causal else 2)
+    return nnz / seq_len**2
+
+
+@lru_cache(maxsize=16)
+def _build_local_mask(
+    seq_len: int,
+    window_size: int,
+    causal: bool,
+    force_sparsity: bool,
+    device: torch.device,
+) -> Any:
+    # Shared by all the LocalAttention layers with the same settings,
+    # built directly on the target device
+    mask = local_1d_pattern(seq_len, window_size, device=device)
+
+    if causal:
+        mask.tril_()
+
+    # Same decision as maybe_sparsify, which would need a device sync to count the mask
+    density = _band_density(seq_len, window_size // 2, causal)
+    if force_sparsity or density <= _DENSITY_THRESHOLD:
+        return sparsify(mask)
+
+    return AttentionMask.from_bool(mask)
+
+
+@lru_cache(maxsize=16)
+def _get_flex_block_mask(
+    seq_len: int, window_size: int, causal: bool, device: torch.device
+) -> Any:
+    # Same pattern as _build_local_mask, but evaluated per tile by FlexAttention,
+    # which skips the key/value blocks which are entirely masked
+    if causal:
+
+        def mask_mod(b, h, q_idx, kv_idx):
+            return (q_idx >= kv_idx) & (q_idx - kv_idx <= window_size)
+
+    else:
+
+        def mask_mod(b, h, q_idx, kv_idx):
+            return (q_idx - kv_idx).abs() <= window_size // 2
+
+    return create_block_mask(
+        mask_mod, B=None, H=None, Q_LEN=seq_len, KV_LEN=seq_len, device=device
+    )
+
+
+def clear_local_mask_cache() -> None:
+    """
+    Release the masks shared by the LocalAttention layers. They are kept, on their
+    device, for the 16 most recent (sequence length, settings, device) combinations
+    """
+    _build_local_mask.cache_clear()
+    _get_flex_block_mask.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _compiled_flex_attention():
+    # FlexAttention only generates its fused kernels when compiled
+    return torch.compile(flex_attention, dynamic=False)
+
 
 @dataclass
 class LocalAttentionConfig(AttentionConfig):
     causal: Optional[bool] = None
     window_size: Optional[int] = None
     force_sparsity: Optional[bool] = None
+    use_flex: Optional[bool] = None
 
 
 @register_attention("local", LocalAttentionConfig)
@@ -40,6 +113,7 @@ class LocalAttention(Attention):
         causal: bool = False,
         window_size: int = 5,
         force_sparsity: bool = False,
+        use_flex: bool = False,
         *args,
         **kwargs,
     ):
@@ -54,6 +128,8 @@ class LocalAttention(Attention):
             window_size (int): the overall window size for local attention.
                 Odd number is expected if the mask is not causal, as the window size will be evenly
                 distributed on both sides of each query
+            use_flex (bool): compute the attention with FlexAttention (requires PyTorch 2.5+)
+                when no additional mask and no dropout are involved, instead of materializing the mask
 
 
         .. _RoutingTransformer: https://arxiv.org/pdf/2003.05997.pdf
@@ -68,6 +144,10 @@ class LocalAttention(Attention):
         self.attn_drop = nn.Dropout(dropout, inplace=False)
         self.causal = causal
         self.force_sparsity = force_sparsity
+        self.use_flex = use_flex
+
+        if self.use_flex:
+            assert _is_flex_available, "FlexAttention requires PyTorch 2.5 or later"
 
         if not self.causal:
             assert (
@@ -75,23 +155,22 @@ class LocalAttention(Attention):
             ), "The window size is assumed to be odd (counts self-attention + 2 wings)"
 
         self.window_size = window_size
-        self.attention_mask: Optional[torch.Tensor] = None
+        self.attention_mask: Optional[Any] = None
         self.requires_same_k_q_dimensions = True
 
         # Properties specific to this attention mechanism
         self.supports_attention_mask = True
         self.supports_key_padding_mask = False
 
-    def _get_local_mask(self, shape: torch.Size) -> torch.Tensor:
+    def _get_local_mask(self, shape: torch.Size, device: torch.device) -> Any:
         window_size = self.window_size * 2 + 1 if self.causal else self.window_size
-        mask = local_1d_pattern(shape[1], window_size)
-
-        if self.causal:
-            mask &= causal_1d_pattern(shape[1])
-
-        mask = sparsify(mask) if self.force_sparsity else maybe_sparsify(mask)
+        return _build_local_mask(
+            shape[1], window_size, self.causal, self.force_sparsity, device
+        )
 
-        return mask
+    def _window_spans_sequence(self, seq_len: int) -> bool:
+        reach = self.window_size if self.causal else self.window_size // 2
+        return reach >= seq_len - 1
 
     def forward(
         self,
@@ -102,9 +181,38 @@ class LocalAttention(Attention):
         *args,
         **kwargs,
     ):
+        if (
+            att_mask is None
+            and not self.force_sparsity
+            and self._window_spans_sequence(q.shape[1])
+        ):
+            # The window covers the whole sequence, so this is plain (causal) attention,
+            # which the fused kernels can handle without materializing any mask
+            y = torch.nn.functional.scaled_dot_product_attention(
+                q[None],
+                k[None],
+                v[None],
+                dropout_p=self.attn_drop.p if self.training else 0.0,
+                is_causal=self.causal,
+            )
+            return y[0]
+
+        if (
+            self.use_flex
+            and att_mask is None
+            and not (self.training and self.attn_drop.p > 0.0)
+        ):
+            block_mask = _get_flex_block_mask(
+                q.shape[1], self.window_size, self.causal, q.device
+            )
+            # (N, S, hs) -> (1, N, S, hs): the pattern is the same for every head
+            y = _compiled_flex_attention()(
+                q[None], k[None], v[None], block_mask=block_mask
+            )
+            return y[0]
+
         # Local window attention masking
-        if self.attention_mask is None or self.attention_mask.shape[1] != q.shape[1]:
-            self.attention_mask = self._get_local_mask(q.shape).to(q.device)
+        self.attention_mask = self._get_local_mask(q.shape, q.device)
 
         # Take into account the optional user mask
         if att_mask is None:
@@ -5,20 +5,79 @@
 
 
 from dataclasses import dataclass
+from typing import Optional
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from xformers.components import Activation, build_activation
 from xformers.components.feedforward import Feedforward, FeedforwardConfig
 
 from . import register_feedforward
 
+# Mixed bf16/fp16/fp32 x int8 matmul, with one scale per output feature
+_has_int8pack_mm = hasattr(torch.ops.aten, "_weight_int8pack_mm")
+
+
+class _Int8Linear(nn.Module):
+    """
+    Inference-only, weight-only int8 version of a :class:`nn.Linear`,
+    with one scale per output feature.
+
+    On CPU, the matmul consumes the int8 weight directly. Other devices have no
+    such kernel in the supported PyTorch versions, nor do weights whose in_features
+    is not a multiple of 16: :meth:`MLP.to_quantized` refuses them. If the layer is
+    moved to such a device afterwards, the weight is converted to the input dtype
+    on every call, which is slower than running the whole MLP in bfloat16
+    """
+
+    def __init__(self, linear: nn.Linear) -> None:
+        super().__init__()
+        weight = linear.weight.detach()
+        scale = weight.abs().amax(dim=1).clamp(min=1e-8) / 127.0
+        self.register_buffer("weight", (weight / scale[:, None]).round().to(torch.int8))
+        self.register_buffer("scale", scale)
+        self.register_buffer(
+            "bias", linear.bias.detach() if linear.bias is not None else None
+        )
+
+    @staticmethod
+    def _has_int8_kernel(weight: torch.Tensor) -> bool:
+        # The bfloat16 kernel reads garbage unless in_features is a multiple of 16
+        return (
+            _has_int8pack_mm
+            and weight.device.type == "cpu"
+            and weight.shape[1] % 16 == 0
+        )
+
+    def _use_int8_kernel(self, x: torch.Tensor) -> bool:
+        return self._has_int8_kernel(self.weight) and x.dtype in (
+            torch.float32,
+            torch.float16,
+            torch.bfloat16,
+        )
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if self._use_int8_kernel(x):
+            y = torch.ops.aten._weight_int8pack_mm(
+                x.reshape(-1, x.shape[-1]).contiguous(),
+                self.weight,
+                self.scale.to(x.dtype),
+            ).view(*x.shape[:-1], -1)
+        else:
+            # The per-row scale commutes with the matmul: apply it to the (smaller) output
+            y = F.linear(x, self.weight.to(x.dtype)) * self.scale.to(x.dtype)
+        if self.bias is not None:
+            y += self.bias.to(x.dtype)
+        return y
+
 
 @dataclass
 class MlpConfig(FeedforwardConfig):
     hidden_layer_multiplier: int
     bias: bool
+    torch_compile: Optional[bool] = None
 
 
 @register_feedforward("MLP", MlpConfig)
@@ -30,6 +89,7 @@ class MLP(Feedforward):
         activation: Activation,
         hidden_layer_multiplier: int,
         bias: bool = True,
+        torch_compile: bool = False,
         *args,
         **kwargs,
     ):
@@ -43,5 +103,88 @@ class MLP(Feedforward):
             nn.Dropout(dropout),
         )
 
+        if torch_compile:
+            # Lets Inductor fuse the bias, activation and dropout into the matmuls.
+            # Compiled in place, so that the parameter names are unchanged
+            self.mlp.compile()
+
+        self.sparse_top_k: Optional[int] = None
+        self.register_buffer("_sparse_w2", None, persistent=False)
+
     def forward(self, inputs: torch.Tensor) -> torch.Tensor:
+        # The snapshot of the second projection does not track the gradients
+        if (
+            self.sparse_top_k is not None
+            and not self.training
+            and not torch.is_grad_enabled()
+        ):
+            return self._sparse_forward(inputs)
         return self.mlp(inputs)
+
+    def _sparse_forward(self, inputs: torch.Tensor) -> torch.Tensor:
+        # Dropouts are no-ops at inference
+        hidden = self.mlp[1](self.mlp[0](inputs))
+        hidden = hidden.reshape(-1, hidden.shape[-1])
+        indices = hidden.abs().topk(self.sparse_top_k, dim=-1).indices
+
+        # Weighted sum of the selected rows of W2^T, without materializing them
+        y = F.embedding_bag(
+            indices,
+            self._sparse_w2,
+            per_sample_weights=hidden.gather(-1, indices),
+            mode="sum",
+        )
+        if self.mlp[3].bias is not None:
+            y = y + self.mlp[3].bias
+        return y.reshape(*inputs.shape[:-1], y.shape[-1])
+
+    @torch.no_grad()
+    def enable_sparse_ffn(self, top_k: Optional[int]) -> "MLP":
+        """
+        At inference (eval mode, without gradients), only keep the `top_k` largest hidden activations of each token,
+        and only use the matching rows of the second projection.
+        This approximates the MLP, assuming that most hidden activations are close to zero.
+        The second projection is snapshot when this is called: call it again after
+        updating the weights, or with `top_k=None` to go back to the dense computation
+        """
+        if top_k is None:
+            self.sparse_top_k = None
+            self._sparse_w2 = None
+            return self
+
+        linear = self.mlp[3]
+        assert isinstance(
+            linear, nn.Linear
+        ), "Sparse inference requires a floating point second projection"
+        self.sparse_top_k = top_k
+        self._sparse_w2 = linear.weight.t().contiguous()
+        return self
+
+    @torch.no_grad()
+    def to_quantized(self, mode: str) -> "MLP":
+        """
+        Converts the MLP weights for inference, in place.
+        `mode` is either "bf16" (cast everything to bfloat16),
+        or "int8" (weight-only int8 linear layers, computing in the input dtype,
+        see :class:`_Int8Linear`). "int8" needs an int8 matmul kernel for every
+        linear layer, which PyTorch currently only has on CPU
+        """
+        if mode == "bf16":
+            return self.to(torch.bfloat16)
+
+        if mode != "int8":
+            raise ValueError(f"Unsupported quantization mode: {mode}")
+
+        for layer in self.mlp:
+            if isinstance(layer, nn.Linear) and not _Int8Linear._has_int8_kernel(
+                layer.weight
+            ):
+                raise ValueError(
+                    f"No int8 matmul kernel for a {tuple(layer.weight.shape)} weight"
+                    f" on {layer.weight.device}, use 'bf16' instead"
+                )
+
+        for i, layer in enumerate(self.mlp):
+            if isinstance(layer, nn.Linear):
+                self.mlp[i] = _Int8Linear(layer)
+        return self
@@ -12,6 +12,7 @@ from dataclasses import dataclass
 from typing import Optional, Tuple
 
 import torch
+import torch.nn.functional as F
 from torch import nn
 
 logger = logging.getLogger("xformers")
@@ -80,6 +81,18 @@ class InputProjection(nn.Module):
                 self.k_proj.weight = self.q_proj.weight
                 self.v_proj.weight = self.q_proj.weight
 
+    def _packed_qkv(self) -> Optional[Tuple[torch.Tensor, Optional[torch.Tensor]]]:
+        projs = (self.q_proj, self.k_proj, self.v_proj)
+        biases = [p.bias for p in projs]
+        if any(b is None for b in biases) and any(b is not None for b in biases):
+            return None
+
+        # Concatenated on every call, which is cheap next to the GEMM,
+        # and always in sync with the current parameters
+        weight = torch.cat([p.weight for p in projs])
+        bias = torch.cat(biases) if biases[0] is not None else None  # type: ignore
+        return weight, bias
+
     def forward(
         self,
         query: torch.Tensor,
@@ -88,7 +101,16 @@ class InputProjection(nn.Module):
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         # One projection per input tensor
 
-        # NOTE: Would it make sense to catch self attention + shared weights, to skip a projection step ?
+        # Self attention at inference: a single GEMM for the three projections, bias included
+        if query is key and key is value and not torch.is_grad_enabled():
+            packed = self._packed_qkv()
+            if packed is not None:
+                qkv = F.linear(query, *packed)
+                q, k, v = qkv.split(
+                    [p.out_features for p in (self.q_proj, self.k_proj, self.v_proj)],
+                    dim=-1,
+                )
+                return q, k, v
 
         q, k, v = map(
             lambda fn, x: fn(x),
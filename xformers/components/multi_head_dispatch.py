@@ -156,12 +156,22 @@ class MultiHeadDispatch(nn.Module):
         value: Optional[torch.Tensor] = None,
         att_mask: Optional[torch.Tensor] = None,
         key_padding_mask: Optional[torch.Tensor] = None,
+        precomputed_kv: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
     ) -> torch.Tensor:
         """
         Expected input dimensions are [batch size, sequence length, embed dim]
         Output dimensions are [batch size, sequence length, embed dim]
+
+        `precomputed_kv` optionally holds the keys and values already projected
+        by :meth:`project_kv`, in which case `key` and `value` are ignored
         """
 
+        if precomputed_kv is not None:
+            assert (
+                not self.attention.requires_skip_multi_head
+            ), "This attention does not use the key and value projections"
+            key, value = precomputed_kv
+
         if key is None:
             key = query
         if value is None:
@@ -206,7 +216,10 @@ class MultiHeadDispatch(nn.Module):
 
         # Calculate query, key, values for all heads in batch
         if self.attention.requires_input_projection:
-            q, k, v = self.in_proj_container(query=query, key=key, value=value)
+            if precomputed_kv is not None:
+                q, k, v = self.in_proj_container.q_proj(query), key, value
+            else:
+                q, k, v = self.in_proj_container(query=query, key=key, value=value)
         else:
             k, q, v = key, query, value
 
@@ -258,6 +271,17 @@ class MultiHeadDispatch(nn.Module):
         # Return the same sequence size as the input
         return y
 
+    def project_kv(
+        self, key: torch.Tensor, value: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Projects the keys and values only, for instance to reuse them through
+        `precomputed_kv` when attending to the same memory over and over
+        """
+        if not self.attention.requires_input_projection:
+            return key, value
+        return self.in_proj_container.k_proj(key), self.in_proj_container.v_proj(value)
+
     @classmethod
     def from_config(cls, config: MultiHeadDispatchConfig):
         # Generate the class inputs from the config
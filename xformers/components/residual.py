@@ -6,11 +6,13 @@
 
 from collections import namedtuple
 from enum import Enum
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import torch
 import torch.nn as nn
 
+from xformers import _is_triton_available
+
 
 class ResidualNormStyle(str, Enum):
     """Support different residual path and norm styles.
@@ -70,17 +72,24 @@ class Residual(nn.Module, RequiresWrappedInputs):
         # PreNorm and PostNorm require all the tensors to be passed as a list
         self.wrap_inputs = isinstance(layer, RequiresWrappedInputs)
 
-    def forward(self, inputs: List[torch.Tensor], **kwargs):
+    def residue_and_output(
+        self, inputs: List[torch.Tensor], **kwargs
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Both terms of the residual sum, so that callers can fuse the addition"""
         if self.scale is not None:
             residue = inputs[0] * self.scale
         else:
             residue = inputs[0]
 
         if self.wrap_inputs:
-            return residue + self.layer(inputs=inputs, **kwargs)
+            return residue, self.layer(inputs=inputs, **kwargs)
 
         else:
-            return residue + self.layer(*inputs, **kwargs)
+            return residue, self.layer(*inputs, **kwargs)
+
+    def forward(self, inputs: List[torch.Tensor], **kwargs):
+        residue, x = self.residue_and_output(inputs, **kwargs)
+        return residue + x
 
 
 class PreNorm(nn.Module, RequiresWrappedInputs):
@@ -105,15 +114,14 @@ class PreNorm(nn.Module, RequiresWrappedInputs):
     def forward(self, inputs: List[torch.Tensor], **kwargs):
         assert len(inputs) > 0
 
-        # Perf improvement: if the inputs are all the same, only norm once
-        ids = [id(x) for x in inputs]
-        if ids.count(ids[0]) == len(ids):
-            # The same tensor is passed multiple times
-            x_norm = self.norm(inputs[0])
-            inputs_normed = [x_norm for _ in inputs]
-        else:
-            # The inputs differ, norm them all
-            inputs_normed = [self.norm(x_) for x_ in inputs]
+        # Perf improvement: the tensors passed multiple times (for instance the same
+        # memory as key and value in cross-attention) are only normed once
+        normed: Dict[int, torch.Tensor] = {}
+        inputs_normed = []
+        for x_ in inputs:
+            if id(x_) not in normed:
+                normed[id(x_)] = self.norm(x_)
+            inputs_normed.append(normed[id(x_)])
 
         if self.wrap_inputs:
             return self.sublayer(inputs=inputs_normed, **kwargs)
@@ -133,11 +141,41 @@ class PostNorm(nn.Module, RequiresWrappedInputs):
     ):
         super().__init__()
         self.norm = get_normalization_layer(normalization)(d_norm)
+        self.use_triton = use_triton
 
         self.sublayer = sublayer
         self.wrap_inputs = isinstance(sublayer, RequiresWrappedInputs)
 
+    def _can_fuse_residual(self, x: torch.Tensor) -> bool:
+        # The fused add + LayerNorm kernel is forward only
+        return (
+            self.use_triton
+            and isinstance(self.sublayer, Residual)
+            and type(self.norm) is nn.LayerNorm
+            and x.is_cuda
+            and x.dtype in (torch.float16, torch.bfloat16)
+            and not torch.is_grad_enabled()
+            and _is_triton_available()
+        )
+
     def forward(self, inputs: List[torch.Tensor], **kwargs):
+        if self._can_fuse_residual(inputs[0]):
+            from xformers.ops.layernorm import layer_norm_add
+
+            # Add the residual and normalize in a single pass
+            assert isinstance(self.sublayer, Residual)
+            assert isinstance(self.norm, nn.LayerNorm)
+            residue, x = self.sublayer.residue_and_output(inputs, **kwargs)
+            if x.dtype != residue.dtype:
+                return self.norm(residue + x)
+            return layer_norm_add(
+                residue.contiguous(),
+                x.contiguous(),
+                self.norm.weight,
+                self.norm.bias,
+                self.norm.eps,
+            )
+
         if self.wrap_inputs:
             x = self.sublayer(inputs=inputs, **kwargs)
         else:
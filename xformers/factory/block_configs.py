@@ -120,6 +120,7 @@ class xFormerEncoderConfig(xFormerBlockConfig):
     use_triton: bool
     simplicial_embeddings: Optional[Dict[str, Any]]
     patch_embedding_config: Optional[Dict[str, Any]]
+    torch_compile: bool
 
     def __init__(
         self,
@@ -132,6 +133,7 @@ class xFormerEncoderConfig(xFormerBlockConfig):
         use_triton: bool = True,
         simplicial_embeddings: Optional[Dict[str, Any]] = None,
         patch_embedding_config: Optional[Dict[str, Any]] = None,
+        torch_compile: bool = False,
         **kwargs,
     ):
         # Convenience, fill in duplicated fields
@@ -173,6 +175,7 @@ class xFormerEncoderConfig(xFormerBlockConfig):
         self.use_triton = use_triton
         self.simplicial_embeddings = simplicial_embeddings
         self.patch_embedding_config = patch_embedding_config
+        self.torch_compile = torch_compile
 
 
 @dataclass(init=False)
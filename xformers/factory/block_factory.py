@@ -13,6 +13,7 @@ import torch.nn as nn
 
 from xformers._deprecation_warning import deprecated_function
 from xformers.components import (
+    MultiHeadDispatch,
     PatchEmbeddingConfig,
     PostNorm,
     PreNorm,
@@ -185,6 +186,11 @@ class xFormerEncoderBlock(torch.nn.Module):
                 PatchEmbeddingConfig(**config.patch_embedding_config)
             )
 
+        if config.torch_compile:
+            # Lets Inductor fuse the residual adds, norms and pointwise ops across the block.
+            # Compiled in place, so that the parameter names are unchanged
+            self.compile(dynamic=False)
+
     @classmethod
     def from_config(cls, config: xFormerEncoderConfig):
         return cls(config)
@@ -327,6 +333,30 @@ class xFormerDecoderBlock(torch.nn.Module):
     def from_config(cls, config: xFormerDecoderConfig):
         return cls(config)
 
+    def precompute_cross_kv(
+        self, memory: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Keys and values of the cross attention, which only depend on the memory.
+        They can be passed as `cross_kv` to all the forward calls attending to the same
+        memory (for instance when decoding step by step), instead of being recomputed
+        """
+        # Unwrap the residual and normalization layers, keeping the input norm if any
+        layer: nn.Module = self.wrap_cross
+        norm: Optional[nn.Module] = None
+        while not isinstance(layer, MultiHeadDispatch):
+            if isinstance(layer, Residual):
+                layer = layer.layer
+            else:
+                assert isinstance(layer, (PreNorm, PostNorm))
+                if isinstance(layer, PreNorm):
+                    norm = layer.norm
+                layer = layer.sublayer
+
+        if norm is not None:
+            memory = norm(memory)
+        return layer.project_kv(memory, memory)
+
     def forward(
         self,
         target: torch.Tensor,
@@ -334,6 +364,7 @@ class xFormerDecoderBlock(torch.nn.Module):
         encoder_att_mask: Optional[Union[torch.Tensor, AttentionMask]] = None,
         decoder_att_mask: Optional[Union[torch.Tensor, AttentionMask]] = None,
         input_mask: Optional[torch.Tensor] = None,
+        cross_kv: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
     ):
         if self.pose_encoding is not None:
             target = self.pose_encoding(target)
@@ -352,7 +383,13 @@ class xFormerDecoderBlock(torch.nn.Module):
         x = self.wrap_att(
             inputs=[target_q, target_k, target_v], att_mask=decoder_att_mask
         )
-        x = self.wrap_cross(inputs=[x, memory, memory], att_mask=encoder_att_mask)
+        if cross_kv is None:
+            x = self.wrap_cross(inputs=[x, memory, memory], att_mask=encoder_att_mask)
+        else:
+            # The memory has already been normalized and projected
+            x = self.wrap_cross(
+                inputs=[x], att_mask=encoder_att_mask, precomputed_kv=cross_kv
+            )
         x = self.wrap_ff(inputs=[x])
 
         return x
@@ -10,7 +10,7 @@ import logging
 from hydra.core.config_store import ConfigStore
 from omegaconf.errors import ValidationError
 
-from xformers.components.attention import ATTENTION_REGISTRY
+from xformers.components.attention import ATTENTION_REGISTRY, _import_all_attentions
 from xformers.components.feedforward import FEEDFORWARD_REGISTRY
 from xformers.components.positional_embedding import POSITION_EMBEDDING_REGISTRY
 
@@ -23,6 +23,8 @@ def import_xformer_config_schema():
     certain config classes. For example, pytorch typing are not supported.
     """
     cs = ConfigStore.instance()
+    # All the attentions need to be registered, even if XFORMERS_EAGER_IMPORT=0
+    _import_all_attentions()
 
     for k, v in {
         "ff": FEEDFORWARD_REGISTRY,
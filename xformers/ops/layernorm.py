@@ -0,0 +1,44 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+from typing import Optional
+
+import torch
+
+from .. import _is_triton_available
+
+
+def layer_norm_add(
+    x: torch.Tensor,
+    y: torch.Tensor,
+    weight: Optional[torch.Tensor],
+    bias: Optional[torch.Tensor],
+    eps: float = 1e-5,
+):
+    """
+    An addition fused with layer_norm, along the last dimension.
+
+        z = layer_norm_add(x, y, weight, bias, eps)
+
+    is equivalent to
+
+        z = torch.nn.functional.layer_norm(x + y, x.shape[-1:], weight, bias, eps)
+
+    where x, y and z are all contiguous. Unlike rms_norm_add, x is left untouched,
+    the sum is only ever held in registers.
+
+    This functionality is experimental. Its API might be changed without warnings.
+    Use it at your own risk.
+    """
+    if torch.is_grad_enabled() and (
+        x.requires_grad
+        or y.requires_grad
+        or (weight is not None and weight.requires_grad)
+        or (bias is not None and bias.requires_grad)
+    ):
+        raise ValueError("Gradients not supported.")
+    assert _is_triton_available()
+    from ._triton.layernorm_kernels import _layer_norm_add_forward
+
+    return _layer_norm_add_forward(x, y, weight, bias, eps)
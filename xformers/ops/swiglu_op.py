@@ -82,8 +82,9 @@ class _SwiGLUDecomposedFunc(torch.autograd.Function):
 
     def _silu_backward(dy, x):
         # https://github.com/pytorch/pytorch/blob/563b065f5a4b4055fa6b025c2514b566d5fd9439/aten/src/ATen/native/Activation.cpp#L483
-        sigm = 1 / (1 + torch.exp(-x.float()))
-        return (dy.float() * sigm * (1 + x.float() * (1 - sigm))).to(x.dtype)
+        # Computed in the inputs' dtype: FORCE_BW_F32 already upcasts them if needed
+        sigm = torch.sigmoid(x)
+        return (dy * sigm * (1 + x * (1 - sigm))).to(x.dtype)
 
     # 952us
     @classmethod
@@ -94,7 +95,8 @@ class _SwiGLUDecomposedFunc(torch.autograd.Function):
         x4 = x3 * x2  # 90us
         x5 = x4 @ w3.transpose(-2, -1) + b3  # 250us
 
-        ctx.save_for_backward(x, w1, b1, w2, b2, w3, b3, x1, x2, x3, x4, x5)
+        # The biases and x5 are not needed for the backward, and x3 is cheap to recompute
+        ctx.save_for_backward(x, w1, w2, w3, x1, x2, x4)
         return x5
 
     # 1900us
@@ -104,7 +106,8 @@ class _SwiGLUDecomposedFunc(torch.autograd.Function):
         if cls.FORCE_BW_F32:
             dx5 = dx5.float()
             saved_tensors = [t.float() for t in ctx.saved_tensors]
-        x, w1, b1, w2, b2, w3, b3, x1, x2, x3, x4, x5 = saved_tensors
+        x, w1, w2, w3, x1, x2, x4 = saved_tensors
+        x3 = F.silu(x1)  # 62us
         dx4 = dx5 @ w3  # 255us (nn)
         dw3 = dx5.transpose(-2, -1) @ x4  # 247us (nt)
         db3 = dx5.sum(0)  # 25us
@@ -157,30 +160,28 @@ class _SwiGLUFusedFunc(torch.autograd.Function):
 
         dw3, db3 = cls._linear_bw(dx5, x4, bias=ctx.bias[2])
         del x4, dx5
+        assert dx1dx2.is_contiguous()
+        dx1dx2 = dx1dx2.view([dx1.shape[0], 2 * dx1.shape[1]])
+
+        # backward of linear1 + linear2 - packed, whether the weights are or not
+        dw1dw2, db1db2 = cls._linear_bw(dx1dx2, x, bias=ctx.bias[0] or ctx.bias[1])
+        dw1, dw2 = dw1dw2.view([2, *w1.shape]).unbind(0)
+        db1: Optional[torch.Tensor] = None
+        db2: Optional[torch.Tensor] = None
+        if db1db2 is not None:
+            db1, db2 = db1db2.view([2, dx1.shape[1]]).unbind(0)
+            db1 = db1 if ctx.bias[0] else None
+            db2 = db2 if ctx.bias[1] else None
+
         if w1w2 is not None:
-            assert dx1dx2.is_contiguous()
             assert w1w2.is_contiguous()
             w1w2 = w1w2.view([w1.shape[0] * 2, w1.shape[1]])
-            dx = dx1dx2.view([dx1.shape[0], 2 * dx1.shape[1]]) @ w1w2
-
-            # backward of linear1 + linear2 - packed
-            dw1dw2 = dx1dx2.view([dx1.shape[0], 2 * dx1.shape[1]]).transpose(-2, -1) @ x
-            dw1dw2, db1db2 = cls._linear_bw(
-                dx1dx2.view([dx1.shape[0], 2 * dx1.shape[1]]), x, bias=ctx.bias[0]
-            )
-            dw1, dw2 = dw1dw2.view([2, *w1.shape]).unbind(0)
-            if ctx.bias[0]:
-                db1db2 = db1db2.view([2, dx1.shape[1]])
-                db1, db2 = torch.unbind(db1db2, dim=0)
-            else:
-                db1 = db2 = None
+            dx = dx1dx2 @ w1w2
         else:
             dx = dx2 @ w2  # 260us (nn)
             torch.addmm(
                 dx, dx1, w1.to(dx1.dtype), beta=1, alpha=1, out=dx
             )  # dx += dx1 @ w1
-            dw2, db2 = cls._linear_bw(dx2, x, bias=ctx.bias[1])
-            dw1, db1 = cls._linear_bw(dx1, x, bias=ctx.bias[0])
         return (dx, dw1, db1, dw2, db2, dw3, db3)
 
 
@@ -232,8 +233,23 @@ def _eager_functional_swiglu(
     w3: torch.Tensor,
     b3: torch.Tensor,
 ) -> torch.Tensor:
-    x1 = F.linear(x, w1, b1)
-    x2 = F.linear(x, w2, b2)
+    w1w2 = stack_or_none((w1, w2), dim=0)
+    b1b2 = stack_or_none((b1, b2), dim=0) if b1 is not None and b2 is not None else None
+    if (
+        w1w2 is not None
+        and w1w2.is_contiguous()
+        and ((b1 is None and b2 is None) or (b1b2 is not None and b1b2.is_contiguous()))
+    ):
+        # w1/w2 are packed: compute both projections with a single GEMM
+        x12 = F.linear(
+            x,
+            w1w2.view([2 * w1.shape[0], w1.shape[1]]),
+            b1b2.view([2 * w1.shape[0]]) if b1b2 is not None else None,
+        )
+        x1, x2 = x12.chunk(2, dim=-1)
+    else:
+        x1 = F.linear(x, w1, b1)
+        x2 = F.linear(x, w2, b2)
     hidden = F.silu(x1) * x2
     return F.linear(hidden, w3, b3)
 
@@ -9,7 +9,8 @@ import os
 import sys
 from collections import namedtuple
 from dataclasses import fields
-from typing import Any, Callable, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import torch
 
@@ -65,18 +66,17 @@ def get_registry_decorator(
     return register_item
 
 
+@lru_cache(maxsize=None)
+def _config_field_names(config_class: Any) -> Tuple[str, ...]:
+    return tuple(f.name for f in fields(config_class))
+
+
 def generate_matching_config(superset: Dict[str, Any], config_class: Any) -> Any:
     """Given a superset of the inputs and a reference config class,
     return exactly the needed config"""
 
-    # Extract the required fields
-    field_names = list(map(lambda x: x.name, fields(config_class)))
-    subset = {k: v for k, v in superset.items() if k in field_names}
-
-    # The missing fields get Noned
-    for k in field_names:
-        if k not in subset.keys():
-            subset[k] = None
+    # Extract the required fields, the missing ones get Noned
+    subset = {k: superset.get(k) for k in _config_field_names(config_class)}
 
     return config_class(**subset)
 